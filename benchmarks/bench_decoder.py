@@ -0,0 +1,94 @@
+"""Microbenchmark the frame decoder against the old regex parseMessage.
+
+    python -m benchmarks.bench_decoder [-n 20]
+
+Prints one JSON object per implementation.
+"""
+import argparse, json, re
+from time import perf_counter
+
+from benchmarks.frames import corpus
+from tradingview.helpers.protocol import FrameDecoder
+
+
+def parse_regex(m):
+    # API.parseMessage before the streaming decoder.
+    lines = re.split(r'~m~[0-9]+~m~', m)
+    for i in range(len(lines)):
+        try:
+            lines[i] = json.loads(lines[i])
+        except Exception as e:
+            lines[i] = {}
+
+    return lines
+
+
+def run_regex(messages):
+    count = 0
+    for m in messages:
+        count += sum(1 for resp in parse_regex(m) if 'm' in resp)
+    return count
+
+
+def run_decoder(messages):
+    decoder = FrameDecoder()
+    count = 0
+    for m in messages:
+        count += sum(1 for resp in decoder.feed(m)[0] if 'm' in resp)
+    return count
+
+
+def run_decoder_split(messages):
+    # Worst case for the decoder: every message arrives in two pieces.
+    decoder = FrameDecoder()
+    count = 0
+    for m in messages:
+        half = len(m) // 2
+        count += sum(1 for resp in decoder.feed(m[:half])[0] if 'm' in resp)
+        count += sum(1 for resp in decoder.feed(m[half:])[0] if 'm' in resp)
+    return count
+
+
+IMPLEMENTATIONS = {
+    'regex': run_regex,
+    'decoder': run_decoder,
+    'decoder_split': run_decoder_split,
+}
+
+
+def bench(name, messages, n):
+    func = IMPLEMENTATIONS[name]
+    count = func(messages)
+
+    timings = []
+    for _ in range(n):
+        start = perf_counter()
+        func(messages)
+        timings.append(perf_counter() - start)
+
+    timings.sort()
+    size = sum(len(m) for m in messages)
+    return {
+        'benchmark': 'decoder',
+        'implementation': name,
+        'runs': n,
+        'ws_messages': len(messages),
+        'decoded': count,
+        'mean_ms': 1000 * sum(timings) / n,
+        'p50_ms': 1000 * timings[n // 2],
+        'mb_per_s': size / (sum(timings) / n) / 1e6,
+    }
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('-n', type=int, default=20)
+    opts = args.parse_args()
+
+    messages = corpus()
+    for name in IMPLEMENTATIONS:
+        print(json.dumps(bench(name, messages, opts.n)))
+
+
+if __name__ == '__main__':
+    main()
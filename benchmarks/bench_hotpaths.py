@@ -0,0 +1,251 @@
+"""Offline microbenchmarks for the Stocky and tradingview hot paths.
+
+    python -m benchmarks.bench_hotpaths [-k portfolio] [--repeat 7] [--compare baseline.jsonl]
+
+TradingView is replayed from `benchmarks.frames`, Slack is a FakeWebClient and
+Redis is fakeredis, so nothing leaves the machine. Prints one JSON object per
+case; save the output of one commit and pass it to `--compare` on another to
+get the ratios, with a non-zero exit status if anything got slower than
+`--threshold`.
+"""
+import argparse, json, random, statistics, sys, tempfile
+from time import perf_counter, time
+
+from benchmarks import fakes
+from benchmarks.chat import messages
+from benchmarks.frames import corpus, quote_snapshot
+
+fakes.install()
+
+import stocky as stocky_module
+from stocky import Stocky
+from tradingview.api import API, filter_date, series_cache
+from tradingview.cache import quote_cache
+from tradingview.pool import ConnectionPool
+
+
+SYMBOLS = ['AAPL', 'MSFT', 'TSLA', 'NVDA', 'AMD', 'GME', 'AMC', 'SPY', 'QQQ', 'BRK.B']
+LOTS = (1, 50, 500)
+
+EVENT = {'user': 'U0BENCH', 'channel': 'C0BENCH'}
+
+
+class Case:
+    """`run(state)` is what gets timed. `setup()` builds its state, once per
+    repeat, and isn't; cases that destroy their state run once per setup."""
+
+    def __init__(self, name, run, setup=None, number=100):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+        self.number = number
+
+    def measure(self, repeat):
+        self.run(self.setup())
+
+        timings = []
+        for _ in range(repeat):
+            state = self.setup()
+            start = perf_counter()
+            for _ in range(self.number):
+                self.run(state)
+            timings.append((perf_counter() - start) / self.number)
+
+        return {
+            'benchmark': 'hotpaths',
+            'case': self.name,
+            'number': self.number,
+            'repeat': repeat,
+            'min_us': 1e6 * min(timings),
+            'median_us': 1e6 * statistics.median(timings),
+            'mean_us': 1e6 * statistics.mean(timings),
+        }
+
+
+def protocol_cases():
+    pool = ConnectionPool()
+    api = API('AAPL', pool=pool)
+    stream = corpus(rounds=1)
+
+    def parse(_):
+        for m in stream:
+            api.parseMessage(m)
+
+    def get_quote(_):
+        with API('AAPL', pool=pool, cache=None) as api:
+            api.getQuote(tech=False)
+
+    def get_quotes(_):
+        with API(None, pool=pool, cache=None) as api:
+            api.getQuotes(SYMBOLS[:8])
+
+    def get_chart(_):
+        with API('AAPL', pool=pool, cache=None) as api:
+            api.getChart()
+
+    now = time()
+    dates = [now - 180 * i for i in range(300)]
+
+    def filter_dates(_):
+        return [date for date in dates if filter_date(date)]
+
+    return [
+        Case('parse_message', parse),
+        Case('get_quote', get_quote),
+        Case('get_quotes_8', get_quotes),
+        Case('get_chart', get_chart),
+        Case('filter_date_300', filter_dates),
+    ]
+
+
+def chart_image_cases():
+    tmp = tempfile.mkdtemp(prefix='stonk-bench-')
+    api = API('AAPL')
+    rng = random.Random(4)
+    points = [100 + rng.uniform(-5, 5) for _ in range(300)]
+    counter = iter(range(10 ** 9))
+
+    def miss(_):
+        # A new last point makes a new cache key, so this always renders.
+        api.generateChartImage(tmp, points + [next(counter)], 1.0)
+
+    def hit(_):
+        api.generateChartImage(tmp, points, 1.0)
+
+    return [
+        Case('generate_chart_image_miss', miss, number=10),
+        Case('generate_chart_image_hit', hit),
+    ]
+
+
+def price_block_cases():
+    stocky = Stocky(fakes.FakeWebClient(), fakes.fake_redis())
+    rng = random.Random(5)
+    technicals = {'RECOMMENDATION': 'STRONG_BUY', 'BUY': 14, 'NEUTRAL': 9, 'SELL': 3}
+
+    cases = []
+    for session in ('market', 'pre_market', 'post_market'):
+        data = quote_snapshot('qs_bench', 'AAPL', rng)['p'][1]['v']
+        data.update(current_session=session, technicals=technicals)
+        cases.append(Case(f'get_price_block_{session}', lambda _, data=data: stocky.getPriceBlock(dict(data)), number=1000))
+
+    return cases
+
+
+def parser_cases():
+    try:
+        from parser import Parser
+    except ImportError:
+        print('pyparsing is not installed; skipping parser_parse', file=sys.stderr)
+        return []
+
+    parser = Parser()
+    lines = messages(1000)
+
+    def parse(_):
+        for line in lines:
+            parser.parse(line)
+
+    return [Case('parser_parse_1000', parse, number=5)]
+
+
+def portfolio_cases():
+    redis = fakes.fake_redis()
+    stocky = Stocky(fakes.FakeWebClient(), redis)
+
+    def seed(lots, symbols):
+        redis.flushdb()
+        stocky.client.posts.clear()
+        for i in range(lots):
+            stocky.ledger.open(EVENT['user'], symbols[i % len(symbols)], 1, 100.0)
+
+    cases = []
+    for lots in LOTS:
+        def portfolio_setup(lots=lots):
+            seed(lots, SYMBOLS)
+
+        def portfolio(_):
+            # Price lookups go through the replayed socket, not the cache.
+            quote_cache.clear()
+            stocky.portfolio(EVENT)
+
+        def close_setup(lots=lots):
+            seed(lots, ['AAPL'])
+            quote_cache.clear()
+
+        def close(_, lots=lots):
+            stocky._close_position(EVENT, 'AAPL', lots)
+
+        cases.append(Case(f'portfolio_{lots}', portfolio, portfolio_setup, number=20))
+        cases.append(Case(f'close_position_{lots}', close, close_setup, number=1))
+
+    return cases
+
+
+def check_quotes_cases():
+    stocky_module.ASSETS = tempfile.mkdtemp(prefix='stonk-bench-')
+    stocky = Stocky(fakes.FakeWebClient(), fakes.fake_redis())
+    event = dict(EVENT, text='what do we think of $AAPL $MSFT $NVDA $AMD')
+
+    def check_quotes(_):
+        # Quotes and bars come off the replayed socket every time; the
+        # charts themselves are cached on disk after the first run.
+        quote_cache.clear()
+        series_cache.clear()
+        stocky.check_quotes(event)
+
+    return [Case('check_quotes_4', check_quotes, number=20)]
+
+
+GROUPS = [protocol_cases, chart_image_cases, price_block_cases, parser_cases, portfolio_cases, check_quotes_cases]
+
+
+def compare(results, baseline, threshold):
+    with open(baseline) as f:
+        before = {row['case']: row for row in map(json.loads, f) if row.get('benchmark') == 'hotpaths'}
+
+    regressed = False
+    for row in results:
+        if row['case'] not in before:
+            continue
+
+        ratio = row['min_us'] / before[row['case']]['min_us']
+        slower = ratio > threshold
+        regressed = regressed or slower
+        print(json.dumps({
+            'benchmark': 'hotpaths_compare',
+            'case': row['case'],
+            'baseline_us': before[row['case']]['min_us'],
+            'min_us': row['min_us'],
+            'ratio': ratio,
+            'regressed': slower,
+        }))
+
+    return regressed
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('-k', help='only run cases whose name contains this')
+    args.add_argument('--repeat', type=int, default=5)
+    args.add_argument('--compare', metavar='BASELINE', help='output of an earlier run to compare against')
+    args.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio that counts as a regression')
+    opts = args.parse_args()
+
+    results = []
+    for group in GROUPS:
+        for case in group():
+            if opts.k and opts.k not in case.name:
+                continue
+
+            result = case.measure(opts.repeat)
+            results.append(result)
+            if not opts.compare:
+                print(json.dumps(result))
+
+    if opts.compare and compare(results, opts.compare, opts.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
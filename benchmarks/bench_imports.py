@@ -0,0 +1,115 @@
+"""Cold start: how long importing each entry point takes.
+
+    python -m benchmarks.bench_imports [--repeat 5] [--compare baseline.jsonl]
+
+Each target is imported in a fresh interpreter under `-X importtime`, and
+the fastest of `--repeat` runs is kept. Prints one JSON object per target
+with its total import time, its heaviest direct imports, and which of the
+modules that are meant to load lazily (`tradingview.lazy.HEAVY`) got
+imported anyway. `--compare` works like it does for bench_hotpaths.
+"""
+import argparse, json, re, subprocess, sys
+
+from tradingview.lazy import HEAVY
+
+TARGETS = ['stocky', 'run', 'ledger', 'tradingview']
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(target):
+    """Returns (module, cumulative us, depth) for everything importing
+    `target` pulled in, ending with `target` itself at depth 0. Whatever the
+    interpreter imported on its own before that is left out."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+        capture_output=True, text=True, check=True,
+    )
+
+    # Children are reported before their parent, so the target's imports are
+    # everything since the previous top level module.
+    modules = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+
+        name, us, depth = match.group(4), int(match.group(2)), (len(match.group(3)) - 1) // 2
+        modules.append((name, us, depth))
+        if depth == 0:
+            if name == target:
+                return modules
+            modules = []
+
+    raise RuntimeError(f'{target} was not imported')
+
+
+def measure(target, repeat, top=5):
+    best = None
+    for _ in range(repeat):
+        modules = import_times(target)
+        total = modules[-1][1]
+        if best is None or total < best[0]:
+            best = (total, modules)
+
+    total, modules = best
+    names = {name for name, _, _ in modules}
+    direct = sorted(((us, name) for name, us, depth in modules if depth == 1), reverse=True)
+
+    return {
+        'benchmark': 'imports',
+        'case': target,
+        'repeat': repeat,
+        'total_us': total,
+        'heaviest': {name: us for us, name in direct[:top]},
+        'eager': [name for name in HEAVY if name in names],
+    }
+
+
+def compare(results, baseline, threshold):
+    with open(baseline) as f:
+        before = {row['case']: row for row in map(json.loads, f) if row.get('benchmark') == 'imports'}
+
+    regressed = False
+    for row in results:
+        if row['case'] not in before:
+            continue
+
+        ratio = row['total_us'] / before[row['case']]['total_us']
+        newly_eager = sorted(set(row['eager']) - set(before[row['case']]['eager']))
+        slower = ratio > threshold or bool(newly_eager)
+        regressed = regressed or slower
+        print(json.dumps({
+            'benchmark': 'imports_compare',
+            'case': row['case'],
+            'baseline_us': before[row['case']]['total_us'],
+            'total_us': row['total_us'],
+            'ratio': ratio,
+            'newly_eager': newly_eager,
+            'regressed': slower,
+        }))
+
+    return regressed
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('targets', nargs='*', default=TARGETS, help='modules to import')
+    args.add_argument('--repeat', type=int, default=5)
+    args.add_argument('--compare', metavar='BASELINE', help='output of an earlier run to compare against')
+    args.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio that counts as a regression')
+    opts = args.parse_args()
+
+    results = []
+    for target in opts.targets:
+        result = measure(target, opts.repeat)
+        results.append(result)
+        if not opts.compare:
+            print(json.dumps(result))
+
+    if opts.compare and compare(results, opts.compare, opts.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
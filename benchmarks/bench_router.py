@@ -0,0 +1,73 @@
+"""Messages/sec for command detection on a realistic chat corpus.
+
+    python -m benchmarks.bench_router [-n 100000]
+
+Compares the pyparsing Parser + hasattr dispatch with the Router table.
+Prints one JSON object per implementation.
+"""
+import argparse, json
+from time import perf_counter
+
+from benchmarks.chat import messages
+from router import CommandError
+from stocky import Stocky, commands
+
+
+def run_parser(corpus):
+    from parser import Parser
+
+    parser = Parser()
+    matched = 0
+    for line in corpus:
+        parsed = parser.parse(line)
+        if parsed is not None:
+            method = parsed[0]
+            if hasattr(Stocky, method) and callable(getattr(Stocky, method)):
+                matched += 1
+    return matched
+
+
+def run_router(corpus):
+    matched = 0
+    for line in corpus:
+        try:
+            if commands.match(line) is not None:
+                matched += 1
+        except CommandError:
+            matched += 1
+    return matched
+
+
+IMPLEMENTATIONS = {
+    'parser': run_parser,
+    'router': run_router,
+}
+
+
+def bench(name, corpus):
+    start = perf_counter()
+    matched = IMPLEMENTATIONS[name](corpus)
+    elapsed = perf_counter() - start
+
+    return {
+        'benchmark': 'router',
+        'implementation': name,
+        'messages': len(corpus),
+        'matched': matched,
+        'seconds': elapsed,
+        'messages_per_s': len(corpus) / elapsed,
+    }
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('-n', type=int, default=100000)
+    opts = args.parse_args()
+
+    corpus = messages(opts.n)
+    for name in IMPLEMENTATIONS:
+        print(json.dumps(bench(name, corpus)))
+
+
+if __name__ == '__main__':
+    main()
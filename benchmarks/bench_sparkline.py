@@ -0,0 +1,99 @@
+"""Compare the Pillow sparkline renderer against the old pyplot path.
+
+    python -m benchmarks.bench_sparkline [-n 200]
+
+Each engine runs in its own subprocess so RSS growth is measured cleanly.
+Prints one JSON object per engine.
+"""
+import argparse, json, math, os, subprocess, sys, tempfile
+from time import perf_counter
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def series(n=300):
+    return [100 + 5 * math.sin(i / 15) + (i % 7) * 0.3 for i in range(n)]
+
+
+def render_pyplot(points, color, save_to, figsize=(10, 10)):
+    # The renderer generateChartImage used before the sparkline engine.
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig,ax = plt.subplots(1, 1, figsize=figsize)
+    ax.plot(points, 'g-' if color == 'green' else 'r-')
+
+    for k, v in ax.spines.items():
+        v.set_visible(False)
+
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+    plt.plot(len(points)-1, points[len(points)-1], 'r.')
+    ax.fill_between(range(len(points)), points, len(points) * [min(points)], alpha=0.1, color=color)
+    plt.savefig(save_to, bbox_inches='tight')
+
+
+def render_pillow(points, color, save_to):
+    from tradingview.sparkline import render_sparkline
+    render_sparkline(points, color, save_to)
+
+
+ENGINES = {
+    'pyplot': render_pyplot,
+    'pillow': render_pillow,
+}
+
+
+def run(engine, n):
+    render = ENGINES[engine]
+    points = series()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        save_to = os.path.join(tmp, 'chart.png')
+
+        # First render pays the import cost; keep it out of the timings.
+        render(points, 'green', save_to)
+        rss_start = rss_bytes()
+
+        timings = []
+        for i in range(n):
+            start = perf_counter()
+            render(points, 'green' if i % 2 else 'red', save_to)
+            timings.append(perf_counter() - start)
+
+        size = os.path.getsize(save_to)
+
+    timings.sort()
+    return {
+        'benchmark': 'sparkline',
+        'engine': engine,
+        'renders': n,
+        'mean_ms': 1000 * sum(timings) / n,
+        'p50_ms': 1000 * timings[n // 2],
+        'p95_ms': 1000 * timings[int(n * 0.95) - 1],
+        'rss_growth_bytes': rss_bytes() - rss_start,
+        'png_bytes': size,
+    }
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('-n', type=int, default=200)
+    args.add_argument('--engine', choices=list(ENGINES))
+    opts = args.parse_args()
+
+    if opts.engine:
+        print(json.dumps(run(opts.engine, opts.n)))
+        return
+
+    for engine in ENGINES:
+        subprocess.run([sys.executable, '-m', 'benchmarks.bench_sparkline', '--engine', engine, '-n', str(opts.n)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""A deterministic stand-in for a busy Slack channel.
+
+Mostly ordinary chatter, some `$TICKER` mentions, and about 1% commands,
+including the occasional malformed one.
+"""
+import random
+
+WORDS = (
+    'the market is wild today did you see that earnings call lol i am not selling '
+    'anyone want lunch meeting moved to three ship it looks good to me can you review '
+    'my pr tests are green deploy went fine why is the build red again coffee'
+).split()
+
+TICKERS = ['AAPL', 'MSFT', 'TSLA', 'NVDA', 'AMD', 'GME', 'AMC', 'SPY', 'BRK.B']
+
+COMMANDS = [
+    '!funds', '!portfolio', '!help', '!liquidate',
+    '!buy {qty} {ticker}', '!sell {qty} {ticker}', '!short {qty} {ticker}', '!cover {qty} {ticker}',
+    '!buy {ticker}', '!sell lots {ticker}', '!yolo',
+]
+
+
+def messages(n=100000, seed=3):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < 0.01:
+            corpus.append(rng.choice(COMMANDS).format(qty=rng.randint(1, 500), ticker=rng.choice(TICKERS).lower()))
+        else:
+            words = rng.sample(WORDS, rng.randint(3, 14))
+            if roll < 0.06:
+                words.insert(rng.randint(0, len(words)), f'${rng.choice(TICKERS)}')
+            if roll > 0.98:
+                words[0] = words[0].capitalize() + '!'
+            corpus.append(' '.join(words))
+    return corpus
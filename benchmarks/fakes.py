@@ -0,0 +1,85 @@
+"""Offline stand-ins for TradingView, Slack and Redis.
+
+`ReplaySocket` answers the requests API sends with the recorded-style frames
+from `benchmarks.frames`, so quote and chart lookups run end to end without a
+network. `install()` swaps it in for `websocket.create_connection`, and a
+canned technicals scanner in for tradingview_ta.
+"""
+from time import monotonic, sleep
+from types import SimpleNamespace
+from websocket import WebSocketTimeoutException
+
+import tradingview.pool
+import tradingview.technicals
+from benchmarks.frames import chart_messages, frame, quote_messages
+from tradingview.helpers.protocol import FrameDecoder
+
+
+class ReplaySocket:
+    # Seconds before the answer to a request starts arriving.
+    latency = 0.0
+
+    def __init__(self, url=None, headers=None, timeout=None):
+        self.connected = True
+        self.decoder = FrameDecoder()
+        self.outbox = [frame({'session_id': '<0.1234.5>_benchmark', 'timestamp': 1618000000})]
+        self.ready = 0.0
+
+    def send(self, data):
+        for message in self.decoder.feed(data)[0]:
+            func, params = message['m'], message['p']
+
+            if func == 'quote_add_symbols':
+                symbols = [symbol for symbol in params[1:] if isinstance(symbol, str)]
+                # Drop the hello frame; the socket is already open.
+                self.outbox += quote_messages(symbols, session=params[0])[1:]
+            elif func == 'create_series':
+                self.outbox += chart_messages(session=params[0])
+            else:
+                continue
+
+            self.ready = monotonic() + self.latency
+
+    def recv(self):
+        if not self.outbox:
+            raise WebSocketTimeoutException('Nothing left to replay')
+
+        wait = self.ready - monotonic()
+        if wait > 0:
+            sleep(wait)
+        return self.outbox.pop(0)
+
+    def close(self):
+        self.connected = False
+
+
+class Analysis:
+    summary = {'RECOMMENDATION': 'BUY', 'BUY': 12, 'NEUTRAL': 9, 'SELL': 5}
+
+
+def get_multiple_analysis(screener, interval, symbols, timeout=None):
+    sleep(ReplaySocket.latency)
+    return {symbol: Analysis() for symbol in symbols}
+
+
+def install(latency=0.0):
+    ReplaySocket.latency = latency
+    tradingview.pool.create_connection = ReplaySocket
+    tradingview.technicals.ta = SimpleNamespace(get_multiple_analysis=get_multiple_analysis)
+
+
+class FakeWebClient:
+    """Keeps what would have been posted to Slack."""
+
+    def __init__(self):
+        self.posts = []
+
+    def chat_postMessage(self, **kwargs):
+        self.posts.append(kwargs)
+        return {'ok': True}
+
+
+def fake_redis():
+    # Imported here so benchmarks that don't touch Redis don't need it.
+    import fakeredis
+    return fakeredis.FakeRedis()
@@ -0,0 +1,99 @@
+"""Raw TradingView websocket traffic for offline benchmarks.
+
+The corpus mirrors what a quote + chart lookup receives: the server hello,
+quote session `qsd` updates (a full snapshot followed by small deltas),
+`quote_completed`, heartbeats, and a `timescale_update` carrying 300 bars.
+It is generated deterministically so runs are comparable between commits.
+"""
+import json, random
+
+from tradingview.helpers.protocol import prepend_header
+
+
+def frame(payload):
+    return prepend_header(payload if isinstance(payload, str) else json.dumps(payload, separators=(',', ':')))
+
+
+def quote_snapshot(session, symbol, rng):
+    price = round(rng.uniform(10, 900), 2)
+    return {'m': 'qsd', 'p': [session, {'n': symbol, 's': 'ok', 'v': {
+        'short_name': symbol,
+        'description': f'{symbol} Corporation',
+        'listed_exchange': rng.choice(['NASDAQ', 'NYSE', 'AMEX']),
+        'exchange': 'NASDAQ',
+        'type': 'stock',
+        'currency_code': 'USD',
+        'current_session': rng.choice(['market', 'pre_market', 'post_market']),
+        'lp': price,
+        'ch': round(rng.uniform(-5, 5), 2),
+        'chp': round(rng.uniform(-3, 3), 2),
+        'rtc': round(price * 1.001, 2),
+        'rch': 0.12,
+        'rchp': 0.05,
+        'volume': rng.randint(10 ** 5, 10 ** 8),
+        'bid': price - 0.01,
+        'ask': price + 0.01,
+        'high_price': price * 1.02,
+        'low_price': price * 0.98,
+        'open_price': price * 0.99,
+        'prev_close_price': price * 0.995,
+        'lp_time': 1618000000 + rng.randint(0, 10 ** 5),
+    }}]}
+
+
+def quote_delta(session, symbol, rng):
+    return {'m': 'qsd', 'p': [session, {'n': symbol, 's': 'ok', 'v': {
+        'lp': round(rng.uniform(10, 900), 2),
+        'volume': rng.randint(10 ** 5, 10 ** 8),
+        'lp_time': 1618000000 + rng.randint(0, 10 ** 5),
+    }}]}
+
+
+def bars(n, start, rng):
+    price = rng.uniform(50, 500)
+    series = []
+    for i in range(n):
+        o = price
+        price = max(1, price + rng.uniform(-1, 1))
+        series.append({'i': i, 'v': [start + i * 180, o, max(o, price) + 0.1, min(o, price) - 0.1, price, rng.randint(1000, 100000)]})
+    return series
+
+
+def quote_messages(symbols, session='qs_benchbenchbe', seed=1):
+    """Websocket messages for one batched quote request."""
+    rng = random.Random(seed)
+    messages = [frame({'session_id': '<0.1234.5>_benchmark', 'timestamp': 1618000000, 'release': 'registry.example/bench'})]
+
+    snapshot = ''.join(frame(quote_snapshot(session, symbol, rng)) for symbol in symbols)
+    messages.append(snapshot)
+
+    for _ in range(3):
+        messages.append(''.join(frame(quote_delta(session, symbol, rng)) for symbol in symbols))
+
+    messages.append(frame('~h~1'))
+    messages.append(''.join(frame({'m': 'quote_completed', 'p': [session, symbol]}) for symbol in symbols))
+    return messages
+
+
+def chart_messages(session='cs_benchbenchbe', n=300, start=None, seed=2):
+    """Websocket messages for one chart request."""
+    import time
+
+    rng = random.Random(seed)
+    start = start if start is not None else int(time.time()) - n * 180
+    return [
+        frame({'m': 'symbol_resolved', 'p': [session, 'symbol_1', {'name': 'AAPL', 'session': 'extended', 'timezone': 'America/New_York'}]}),
+        frame({'m': 'series_loading', 'p': [session, 's1', 's1']}),
+        frame({'m': 'timescale_update', 'p': [session, {'s1': {'node': 'bench', 's': bars(n, start, rng), 'ns': {'d': '', 'indexes': []}, 't': 's1', 'lbs': {'bar_close_time': start + n * 180}}}]})
+        + frame({'m': 'series_completed', 'p': [session, 's1', 'streaming']}),
+    ]
+
+
+def corpus(symbols=('AAPL', 'MSFT', 'TSLA', 'NVDA', 'AMD', 'GME', 'AMC', 'SPY'), rounds=10):
+    """A longer mixed stream: quote batches, charts and heartbeats."""
+    messages = []
+    for i in range(rounds):
+        messages += quote_messages(symbols, seed=i)
+        messages += chart_messages(seed=i, start=1618000000)
+        messages.append(frame(f'~h~{i + 2}'))
+    return messages
@@ -0,0 +1,244 @@
+import os, threading
+from collections import deque
+from itertools import takewhile
+from time import monotonic
+
+from tradingview.metrics import span
+
+
+# Slack allows about one message per second per channel.
+CHANNEL_INTERVAL = 1.0
+
+# Slack's limits for a single message.
+MAX_TEXT = 4000
+MAX_BLOCKS = 50
+
+
+def _extras(message):
+    return {key: value for key, value in message.items() if key not in ('text', 'blocks')}
+
+
+def merge(messages, max_text=MAX_TEXT, max_blocks=MAX_BLOCKS):
+    """Merge as many of `messages` (chat_postMessage kwargs, oldest first) as
+    fit into one. Returns (merged, how many were used).
+
+    Only messages of the same kind (text or blocks) with the same other
+    arguments are merged, and never past Slack's size limits.
+    """
+    first = messages[0]
+    extras = _extras(first)
+    blocks = 'blocks' in first
+
+    used = 1
+    size = len(first.get('blocks', [])) if blocks else len(first.get('text', ''))
+    for message in messages[1:]:
+        if ('blocks' in message) != blocks or _extras(message) != extras:
+            break
+
+        if blocks:
+            size += len(message['blocks'])
+            if size > max_blocks:
+                break
+        else:
+            size += len(message.get('text', '')) + 1
+            if size > max_text:
+                break
+
+        used += 1
+
+    if used == 1:
+        return first, 1
+
+    merged = dict(extras)
+    texts = [message['text'] for message in messages[:used] if message.get('text')]
+    if texts:
+        merged['text'] = '\n'.join(texts)
+    if blocks:
+        merged['blocks'] = [block for message in messages[:used] for block in message['blocks']]
+
+    return merged, used
+
+
+def retryable(error):
+    """Whether posting again could work: network errors and Slack's 5xx can
+    pass, but Slack turning the message down (invalid_blocks,
+    channel_not_found, not_in_channel, ...) will happen every time."""
+    # A SlackApiError, checked for by shape so that importing the dispatcher
+    # doesn't import the whole Slack client.
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True
+
+    status = getattr(response, 'status_code', None)
+    return status is None or status >= 500
+
+
+class Dispatcher:
+    """Posts Slack messages in the background, at the pace Slack allows.
+
+    `post` takes the same arguments as `chat_postMessage` and returns right
+    away. Messages are queued per (channel, thread), and whatever piles up
+    while a channel waits its turn goes out as one message. A 429 puts the
+    channel on hold for as long as Retry-After asks; network errors and 5xx
+    are retried with exponential backoff, then dropped. A message Slack
+    rejects outright is dropped at once, and if it went out merged with
+    others, they are sent again one at a time so only it is lost.
+
+    Messages to one channel are posted in order, by one sender at a time.
+    Sender threads are started lazily, so a forked worker process gets its
+    own.
+    """
+
+    def __init__(self, client, workers=2, interval=CHANNEL_INTERVAL, linger=0.05, retries=4):
+        self.client = client
+        self.workers = workers
+        self.interval = interval
+        self.linger = linger
+        self.retries = retries
+
+        # (channel, thread_ts) -> deque of (queued at, attempts, message, alone)
+        self._queues = {}
+        # channel -> monotonic time it can be posted to again
+        self._hold = {}
+        self._sending = set()
+        self._cond = threading.Condition()
+        self._pid = None
+
+        self.queued = 0
+        self.posted = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.split = 0
+        self.dropped = 0
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f'slack-dispatch-{i}', daemon=True).start()
+
+    def post(self, **kwargs):
+        key = (kwargs.get('channel'), kwargs.get('thread_ts'))
+        with self._cond:
+            self._start()
+            self._queues.setdefault(key, deque()).append((monotonic(), 0, kwargs, False))
+            self.queued += 1
+            self._cond.notify()
+
+    def depth(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been posted or dropped."""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while any(self._queues.values()) or self._sending:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 1)
+        return True
+
+    def _take(self, now):
+        """Pick the (channel, thread) that is due first. Returns (key, batch)
+        when one is due now, or (None, seconds to wait)."""
+        best = None
+        wait = None
+        for key, queue in self._queues.items():
+            if not queue or key[0] in self._sending:
+                continue
+
+            due = max(queue[0][0] + self.linger, self._hold.get(key[0], 0))
+            if due <= now and (best is None or due < best[0]):
+                best = (due, key)
+            elif due > now and (wait is None or due - now < wait):
+                wait = due - now
+
+        if best is None:
+            return None, wait
+
+        key = best[1]
+        queue = self._queues.pop(key)
+        self._sending.add(key[0])
+        return key, list(queue)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key, batch = self._take(monotonic())
+                while key is None:
+                    self._cond.wait(batch)
+                    key, batch = self._take(monotonic())
+
+            if batch[0][3]:
+                message, used = batch[0][2], 1
+            else:
+                message, used = merge([message for _, _, message, _ in takewhile(lambda entry: not entry[3], batch)])
+            parts = batch[:used]
+            attempts = parts[0][1]
+            limited = None
+            error = None
+
+            try:
+                with span('slack_post'):
+                    self.client.chat_postMessage(**message)
+            except Exception as e:
+                response = getattr(e, 'response', None)
+                if getattr(response, 'status_code', None) == 429:
+                    limited = float(response.headers.get('Retry-After', 1))
+                else:
+                    error = e
+
+            with self._cond:
+                # Whatever goes back on the queue goes as the messages it was
+                # merged from, so they can still be told apart.
+                if limited is not None:
+                    self.rate_limited += 1
+                    hold = limited
+                    requeue = parts
+                elif error is not None and not retryable(error) and used > 1:
+                    self.failed += 1
+                    self.split += 1
+                    hold = self.interval
+                    requeue = [(queued, tries, part, True) for queued, tries, part, _ in parts]
+                elif error is not None:
+                    self.failed += 1
+                    hold = self.interval * 2 ** attempts
+                    if retryable(error) and attempts < self.retries:
+                        requeue = [(queued, attempts + 1, part, alone) for queued, _, part, alone in parts]
+                    else:
+                        self.dropped += used
+                        requeue = []
+                        print('Unable to post to Slack!')
+                        print(error)
+                else:
+                    self.posted += 1
+                    self.merged += used - 1
+                    hold = self.interval
+                    requeue = []
+
+                # Anything queued while we were posting goes after the rest.
+                queue = deque(requeue + batch[used:])
+                queue.extend(self._queues.pop(key, ()))
+                if queue:
+                    self._queues[key] = queue
+
+                self._hold[key[0]] = monotonic() + hold
+                self._sending.discard(key[0])
+                self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'queued': self.queued,
+            'posted': self.posted,
+            'merged': self.merged,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+            'split': self.split,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,133 @@
+from datetime import datetime
+from time import time
+
+from tradingview.lazy import lazy
+from tradingview.market import EST
+
+np = lazy('numpy')
+
+# Every snapshot is (timestamp, cash, positions value, equity) as four
+# little-endian doubles, appended to a plain Redis string per user and tier.
+FIELDS = ('time', 'cash', 'positions', 'equity')
+RECORD = '<f8'
+RECORD_SIZE = 8 * len(FIELDS)
+
+# (seconds per bucket, buckets kept). A snapshot goes into every tier; within
+# a bucket the latest one wins, so coarser tiers hold the last value of each
+# hour or day.
+TIERS = [
+    (300, 2 * 24 * 12),
+    (3600, 30 * 24),
+    (86400, 5 * 365),
+]
+
+# Strings are trimmed back to the buckets kept once they have grown by a
+# quarter, rather than on every append.
+TRIM = '''
+local size = redis.call('STRLEN', KEYS[1])
+local keep = tonumber(ARGV[1])
+if size > keep then
+    redis.call('SET', KEYS[1], redis.call('GETRANGE', KEYS[1], size - keep, -1))
+end
+'''
+
+
+def bucket(ts, seconds):
+    """Which bucket of `seconds` an epoch timestamp falls in, counted in
+    Eastern time so days and hours line up with the market's."""
+    offset = datetime.fromtimestamp(ts, EST).utcoffset().total_seconds()
+    return int((ts + offset) // seconds)
+
+
+def unpack(data):
+    """Packed snapshots to an (n, 4) array of FIELDS."""
+    usable = len(data) - len(data) % RECORD_SIZE
+    return np.frombuffer(data[:usable], dtype=RECORD).reshape(-1, len(FIELDS))
+
+
+class History:
+    """Equity snapshots for every player, kept compact in Redis.
+
+    `snapshot` marks everyone to market once, from prices the caller already
+    has, and appends one record per player. `series` stitches the tiers back
+    together, daily for the oldest part and five minutely for the newest, so
+    nothing has to be quoted to chart it.
+    """
+
+    def __init__(self, redis, ledger, tiers=TIERS):
+        self.redis = redis
+        self.ledger = ledger
+        self.tiers = tiers
+
+        self._trim = redis.register_script(TRIM)
+
+    def key(self, user, seconds):
+        return f'stonk_history:{seconds}:{user}'
+
+    def snapshot(self, prices, now=None):
+        """Record every player's cash, positions value and equity at `prices`
+        (symbol -> price). Players holding a symbol without a price are
+        skipped rather than recorded as if it were worth nothing. Returns how
+        many players were recorded."""
+        now = time() if now is None else now
+
+        unpriced = [symbol for symbol, price in prices.items() if not price]
+        skip = set()
+        for symbol in unpriced:
+            skip.update(user.decode() for user in self.redis.zrange(f'stonk_exposure:{symbol}', 0, -1))
+
+        equity = {user: value for user, value in self.ledger.leaderboard(prices, count=None) if user not in skip}
+        if not equity:
+            return 0
+
+        users = list(equity)
+        cash = self.redis.mget([f'stonk_cash:{user}' for user in users])
+
+        pipe = self.redis.pipeline(transaction=False)
+        for user in users:
+            for seconds, _ in self.tiers:
+                pipe.strlen(self.key(user, seconds))
+                pipe.getrange(self.key(user, seconds), -RECORD_SIZE, -1)
+        tails = iter(pipe.execute())
+
+        pipe = self.redis.pipeline(transaction=False)
+        for user, balance in zip(users, cash):
+            balance = float(balance or 0)
+            record = np.array([now, balance, equity[user] - balance, equity[user]], dtype=RECORD).tobytes()
+
+            for seconds, kept in self.tiers:
+                key = self.key(user, seconds)
+                size, tail = next(tails), next(tails)
+
+                if len(tail) == RECORD_SIZE and bucket(unpack(tail)[0, 0], seconds) == bucket(now, seconds):
+                    pipe.setrange(key, size - RECORD_SIZE, record)
+                    continue
+
+                pipe.append(key, record)
+                if size + RECORD_SIZE > kept * RECORD_SIZE * 5 // 4:
+                    self._trim(keys=[key], args=[kept * RECORD_SIZE], client=pipe)
+        pipe.execute()
+
+        return len(users)
+
+    def series(self, user):
+        """Returns a user's snapshots as an (n, 4) array of FIELDS, oldest
+        first, using the finest tier available for each stretch of time."""
+        pipe = self.redis.pipeline(transaction=False)
+        for seconds, _ in self.tiers:
+            pipe.get(self.key(user, seconds))
+        tiers = [unpack(data or b'') for data in pipe.execute()]
+
+        parts = []
+        until = None
+        for records in tiers:
+            if until is not None:
+                records = records[records[:, 0] < until]
+            if len(records):
+                parts.append(records)
+                until = records[0, 0]
+
+        if not parts:
+            return np.empty((0, len(FIELDS)), dtype=RECORD)
+
+        return np.concatenate(parts[::-1])
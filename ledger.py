@@ -0,0 +1,621 @@
+import datetime, json
+
+STARTUP_CASH = 100000.00
+
+# Once a (symbol, side) has more lots than this and the oldest is more than
+# COMPACT_AGE seconds old, opening another merges its old lots.
+COMPACT_LOTS = 20
+COMPACT_AGE = 24 * 3600
+
+
+# The leaderboard is kept as
+#   stonk_equity_base   zset user -> cash + 2 * cost basis of open shorts
+#   stonk_exposure:SYM  zset user -> shares long - shares short of SYM
+#   stonk_held          set of symbols someone has exposure to
+# so that equity = base + sum(exposure * price), which ZUNIONSTORE with the
+# prices as weights computes server side. Every script that moves cash or
+# shares keeps these up to date.
+LEADERBOARD = '''
+local function user_of(cash)
+    return string.sub(cash, string.len('stonk_cash:') + 1)
+end
+
+local function init_cash(cash, base, startup)
+    if redis.call('SET', cash, startup, 'NX') then
+        redis.call('ZINCRBY', base, startup, user_of(cash))
+    end
+end
+
+-- Exposure keys depend on the symbol, so they can't be passed in KEYS.
+local function mark(cash, base, held, symbol, shares, price)
+    local user = user_of(cash)
+    local exposure = 'stonk_exposure:' .. symbol
+
+    redis.call('ZINCRBY', base, -shares * price, user)
+    if tonumber(redis.call('ZINCRBY', exposure, shares, user)) == 0 then
+        redis.call('ZREM', exposure, user)
+        if redis.call('ZCARD', exposure) == 0 then
+            redis.call('SREM', held, symbol)
+        end
+    else
+        redis.call('SADD', held, symbol)
+    end
+end
+'''
+
+
+# Positions used to be a single JSON list under stonk_positions:<user>. They
+# now live in a hash of lot id -> lot, and every script converts an old style
+# blob the first time it touches it.
+MIGRATE = '''
+local function migrate(positions, seq)
+    if redis.call('TYPE', positions).ok ~= 'string' then
+        return
+    end
+
+    local lots = cjson.decode(redis.call('GET', positions))
+    redis.call('DEL', positions)
+    for _, lot in ipairs(lots) do
+        redis.call('HSET', positions, redis.call('INCR', seq), cjson.encode(lot))
+    end
+end
+'''
+
+
+# Alongside the lots, every user has
+#   stonk_position_index:USER     hash SYMBOL:side -> {symbol, short, quantity, cost}
+#   stonk_lots:USER:SYMBOL:side   list of lot ids, oldest first
+# so holdings are read per (symbol, side) rather than per lot, and a close
+# only touches the lots it consumes. Users that traded before the index get
+# it built the first time a script touches them.
+INDEX = '''
+local function side_of(short)
+    return short and 'short' or 'long'
+end
+
+local function queue_of(cash, symbol, short)
+    return 'stonk_lots:' .. user_of(cash) .. ':' .. symbol .. ':' .. side_of(short)
+end
+
+local function index_add(index, symbol, short, quantity, cost)
+    local field = symbol .. ':' .. side_of(short)
+    local entry = redis.call('HGET', index, field)
+    local holding = entry and cjson.decode(entry) or {symbol = symbol, short = short, quantity = 0, cost = 0}
+
+    holding.quantity = holding.quantity + quantity
+    holding.cost = holding.cost + cost
+
+    if holding.quantity > 0 then
+        redis.call('HSET', index, field, cjson.encode(holding))
+    else
+        redis.call('HDEL', index, field)
+    end
+end
+
+local function build_index(cash, positions, index)
+    if redis.call('EXISTS', index) == 1 then
+        return
+    end
+
+    local all = redis.call('HGETALL', positions)
+    local lots = {}
+    for i = 1, #all, 2 do
+        table.insert(lots, {id = tonumber(all[i]), lot = cjson.decode(all[i + 1])})
+    end
+
+    table.sort(lots, function(a, b)
+        if a.lot.date == b.lot.date then
+            return a.id < b.id
+        end
+        return a.lot.date < b.lot.date
+    end)
+
+    for _, entry in ipairs(lots) do
+        local lot = entry.lot
+        local short = lot.short == true
+        index_add(index, lot.symbol, short, lot.quantity, lot.price * lot.quantity)
+        redis.call('RPUSH', queue_of(cash, lot.symbol, short), entry.id)
+    end
+end
+'''
+
+SCRIPT = LEADERBOARD + MIGRATE + INDEX + '''
+migrate(KEYS[2], KEYS[3])
+build_index(KEYS[1], KEYS[2], KEYS[6])
+'''
+
+# Merges the lots at the head of `queue` opened before `cutoff` into the
+# first of them. Returns how many lots went away.
+COMPACTION = '''
+local function compact_queue(positions, queue, cutoff)
+    local ids = {}
+    local first
+    local quantity = 0
+    local cost = 0
+    for _, id in ipairs(redis.call('LRANGE', queue, 0, -1)) do
+        local lot = redis.call('HGET', positions, id)
+        if not lot then
+            break
+        end
+
+        lot = cjson.decode(lot)
+        if lot.date >= cutoff then
+            break
+        end
+
+        first = first or lot
+        table.insert(ids, id)
+        quantity = quantity + lot.quantity
+        cost = cost + lot.price * lot.quantity
+    end
+
+    if #ids < 2 then
+        return 0
+    end
+
+    first.quantity = quantity
+    first.price = cost / quantity
+    redis.call('HSET', positions, ids[1], cjson.encode(first))
+
+    for i = 2, #ids do
+        redis.call('HDEL', positions, ids[i])
+    end
+    redis.call('LTRIM', queue, #ids - 1, -1)
+    redis.call('LSET', queue, 0, ids[1])
+
+    return #ids - 1
+end
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: startup cash
+POSITIONS = SCRIPT + '''
+init_cash(KEYS[1], KEYS[4], ARGV[1])
+return {redis.call('GET', KEYS[1]), redis.call('HGETALL', KEYS[2])}
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: startup cash
+HOLDINGS = SCRIPT + '''
+init_cash(KEYS[1], KEYS[4], ARGV[1])
+return {redis.call('GET', KEYS[1]), redis.call('HVALS', KEYS[6])}
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: startup cash
+CASH = LEADERBOARD + '''
+init_cash(KEYS[1], KEYS[4], ARGV[1])
+return redis.call('GET', KEYS[1])
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: startup cash, symbol, price, quantity, date, short, max lots, cutoff
+OPEN = SCRIPT + COMPACTION + '''
+init_cash(KEYS[1], KEYS[4], ARGV[1])
+
+local cash = tonumber(redis.call('GET', KEYS[1]))
+local price = tonumber(ARGV[3])
+local quantity = tonumber(ARGV[4])
+local short = ARGV[6] == '1'
+local cost = price * quantity
+if cost > cash then
+    return {'funds', tostring(cash)}
+end
+
+local id = redis.call('INCR', KEYS[3])
+redis.call('HSET', KEYS[2], id, cjson.encode({
+    symbol = ARGV[2],
+    price = price,
+    quantity = quantity,
+    date = tonumber(ARGV[5]),
+    short = short
+}))
+
+index_add(KEYS[6], ARGV[2], short, quantity, cost)
+local queue = queue_of(KEYS[1], ARGV[2], short)
+if redis.call('RPUSH', queue, id) > tonumber(ARGV[7]) then
+    local head = redis.call('HGET', KEYS[2], redis.call('LINDEX', queue, 0))
+    if head and cjson.decode(head).date < tonumber(ARGV[8]) then
+        compact_queue(KEYS[2], queue, tonumber(ARGV[8]))
+    end
+end
+
+mark(KEYS[1], KEYS[4], KEYS[5], ARGV[2], short and -quantity or quantity, price)
+
+return {'ok', redis.call('INCRBYFLOAT', KEYS[1], -cost), tostring(id)}
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: symbol, short, quantity, price
+CLOSE = SCRIPT + '''
+local short = ARGV[2] == '1'
+local remaining = tonumber(ARGV[3])
+local price = tonumber(ARGV[4])
+local queue = queue_of(KEYS[1], ARGV[1], short)
+
+-- Oldest lots first, and only as many as it takes, a batch at a time.
+local credit = 0
+local closed = 0
+local cost = 0
+local fills = {}
+local done = {}
+local offset = 0
+while remaining > 0 do
+    local ids = redis.call('LRANGE', queue, offset, offset + 49)
+    if #ids == 0 then
+        break
+    end
+
+    local entries = redis.call('HMGET', KEYS[2], unpack(ids))
+    for i, id in ipairs(ids) do
+        if remaining <= 0 then
+            break
+        end
+
+        if not entries[i] then
+            table.insert(done, id)
+        else
+            local lot = cjson.decode(entries[i])
+            local q = math.min(remaining, lot.quantity)
+            local basis = lot.price * q
+            local value = price * q
+            local net
+
+            if short then
+                net = basis - value
+                credit = credit + basis + net
+            else
+                net = value - basis
+                credit = credit + value
+            end
+
+            remaining = remaining - q
+            closed = closed + q
+            cost = cost + basis
+            lot.quantity = lot.quantity - q
+
+            if lot.quantity > 0 then
+                redis.call('HSET', KEYS[2], id, cjson.encode(lot))
+            else
+                table.insert(done, id)
+            end
+
+            table.insert(fills, tostring(q))
+            table.insert(fills, tostring(lot.price))
+            table.insert(fills, tostring(net))
+        end
+    end
+
+    offset = offset + #ids
+end
+
+for i = 1, #done, 50 do
+    redis.call('HDEL', KEYS[2], unpack(done, i, math.min(i + 49, #done)))
+end
+redis.call('LTRIM', queue, #done, -1)
+
+if closed == 0 then
+    return {}
+end
+
+index_add(KEYS[6], ARGV[1], short, -closed, -cost)
+mark(KEYS[1], KEYS[4], KEYS[5], ARGV[1], short and closed or -closed, price)
+
+redis.call('INCRBYFLOAT', KEYS[1], credit)
+
+return fills
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: symbol, price, symbol, price, ...
+CLOSE_ALL = SCRIPT + '''
+local credit = 0
+local result = {}
+for i = 1, #ARGV, 2 do
+    local symbol = ARGV[i]
+    local price = tonumber(ARGV[i + 1])
+
+    for _, short in ipairs({false, true}) do
+        local field = symbol .. ':' .. side_of(short)
+        local entry = redis.call('HGET', KEYS[6], field)
+        if entry then
+            local holding = cjson.decode(entry)
+            local value = price * holding.quantity
+            local net
+
+            if short then
+                net = holding.cost - value
+                credit = credit + holding.cost + net
+            else
+                net = value - holding.cost
+                credit = credit + value
+            end
+
+            local queue = queue_of(KEYS[1], symbol, short)
+            for _, id in ipairs(redis.call('LRANGE', queue, 0, -1)) do
+                redis.call('HDEL', KEYS[2], id)
+            end
+            redis.call('DEL', queue)
+            redis.call('HDEL', KEYS[6], field)
+
+            mark(KEYS[1], KEYS[4], KEYS[5], symbol, short and holding.quantity or -holding.quantity, price)
+
+            table.insert(result, symbol)
+            table.insert(result, short and '1' or '0')
+            table.insert(result, tostring(holding.quantity))
+            table.insert(result, tostring(holding.cost))
+            table.insert(result, tostring(net))
+        end
+    end
+end
+
+table.insert(result, 1, redis.call('INCRBYFLOAT', KEYS[1], credit))
+
+return result
+'''
+
+# Merges the oldest lots of every (symbol, side) that were opened before
+# ARGV[1] into a single lot at their average price. Quantity and cost don't
+# change, so neither do the index or the leaderboard.
+#
+# KEYS: cash, positions, seq, base, held, index
+# ARGV: cutoff timestamp
+COMPACT = SCRIPT + COMPACTION + '''
+local cutoff = tonumber(ARGV[1])
+local merged = 0
+
+for _, entry in ipairs(redis.call('HVALS', KEYS[6])) do
+    local holding = cjson.decode(entry)
+    merged = merged + compact_queue(KEYS[2], queue_of(KEYS[1], holding.symbol, holding.short), cutoff)
+end
+
+return merged
+'''
+
+# KEYS: cash, positions, seq, base, held, index
+RESET = SCRIPT + '''
+local user = user_of(KEYS[1])
+for _, entry in ipairs(redis.call('HVALS', KEYS[6])) do
+    local holding = cjson.decode(entry)
+    local exposure = 'stonk_exposure:' .. holding.symbol
+    redis.call('ZREM', exposure, user)
+    if redis.call('ZCARD', exposure) == 0 then
+        redis.call('SREM', KEYS[5], holding.symbol)
+    end
+    redis.call('DEL', queue_of(KEYS[1], holding.symbol, holding.short))
+end
+
+redis.call('ZREM', KEYS[4], user)
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[6])
+'''
+
+# Rebuilds the leaderboard from every player's cash and holdings. It is one
+# script so no trade can land halfway through and have its marks wiped, and
+# it does nothing once the leaderboard is built, so two processes racing to
+# rebuild it do the work once.
+#
+# KEYS: base, held, built
+REBUILD = LEADERBOARD + MIGRATE + INDEX + '''
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+
+local function scan(pattern)
+    local keys = {}
+    local cursor = '0'
+    repeat
+        local page = redis.call('SCAN', cursor, 'MATCH', pattern, 'COUNT', 1000)
+        cursor = page[1]
+        for _, key in ipairs(page[2]) do
+            table.insert(keys, key)
+        end
+    until cursor == '0'
+    return keys
+end
+
+for _, exposure in ipairs(scan('stonk_exposure:*')) do
+    redis.call('DEL', exposure)
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+
+local players = 0
+for _, cash in ipairs(scan('stonk_cash:*')) do
+    local user = user_of(cash)
+    local positions = 'stonk_positions:' .. user
+    local index = 'stonk_position_index:' .. user
+    migrate(positions, 'stonk_lot_seq:' .. user)
+    build_index(cash, positions, index)
+
+    local base = tonumber(redis.call('GET', cash))
+    for _, entry in ipairs(redis.call('HVALS', index)) do
+        local holding = cjson.decode(entry)
+        if holding.short then
+            base = base + 2 * holding.cost
+        end
+        -- At a price of zero, mark only moves the exposure.
+        mark(cash, KEYS[1], KEYS[2], holding.symbol, holding.short and -holding.quantity or holding.quantity, 0)
+    end
+
+    redis.call('ZADD', KEYS[1], base, user)
+    players = players + 1
+end
+
+redis.call('SET', KEYS[3], 1)
+return players
+'''
+
+
+class Ledger:
+    """Cash and positions for every player, kept in Redis.
+
+    Every trade is a single Lua script, so it is one round trip and can't be
+    interleaved with another trade by the same user.
+    """
+
+    def __init__(self, redis, startup_cash=STARTUP_CASH):
+        self.redis = redis
+        self.startup_cash = startup_cash
+
+        self._cash = redis.register_script(CASH)
+        self._positions = redis.register_script(POSITIONS)
+        self._holdings = redis.register_script(HOLDINGS)
+        self._open = redis.register_script(OPEN)
+        self._close = redis.register_script(CLOSE)
+        self._close_all = redis.register_script(CLOSE_ALL)
+        self._compact = redis.register_script(COMPACT)
+        self._reset = redis.register_script(RESET)
+        self._rebuild = redis.register_script(REBUILD)
+
+    def keys(self, user):
+        return [
+            f'stonk_cash:{user}', f'stonk_positions:{user}', f'stonk_lot_seq:{user}',
+            'stonk_equity_base', 'stonk_held', f'stonk_position_index:{user}',
+        ]
+
+    def cash(self, user):
+        return float(self._cash(keys=self.keys(user), args=[self.startup_cash]))
+
+    def account(self, user):
+        """Returns (cash, positions) for a user in one round trip, with one
+        position per lot."""
+        cash, lots = self._positions(keys=self.keys(user), args=[self.startup_cash])
+
+        positions = []
+        for i in range(0, len(lots), 2):
+            positions.append({'id': int(lots[i]), **json.loads(lots[i + 1])})
+
+        return float(cash), positions
+
+    def positions(self, user):
+        return self.account(user)[1]
+
+    def holdings(self, user):
+        """Returns (cash, holdings) with one holding per (symbol, side): total
+        quantity, total cost and the average price paid."""
+        cash, index = self._holdings(keys=self.keys(user), args=[self.startup_cash])
+
+        holdings = []
+        for entry in index:
+            holding = json.loads(entry)
+            holding['quantity'] = int(holding['quantity'])
+            holding['price'] = holding['cost'] / holding['quantity']
+            holdings.append(holding)
+
+        return float(cash), holdings
+
+    def open(self, user, symbol, quantity, price, short=False):
+        position = {
+            'symbol': symbol,
+            'price': price,
+            'quantity': quantity,
+            'date': datetime.datetime.now().timestamp(),
+            'short': short
+        }
+
+        result = self._open(keys=self.keys(user), args=[
+            self.startup_cash, symbol, repr(float(price)), int(quantity), repr(position['date']), int(short),
+            COMPACT_LOTS, repr(position['date'] - COMPACT_AGE),
+        ])
+
+        if result[0].decode() == 'funds':
+            return {'status': 'funds', 'cash': float(result[1])}
+
+        return {'status': 'ok', 'cash': float(result[1]), 'id': int(result[2]), **position}
+
+    def close(self, user, symbol, quantity, price, short=False):
+        """Close `quantity` shares FIFO. Returns a list of fills, one per lot
+        touched, or an empty list if the user holds none of `symbol`."""
+        result = self._close(keys=self.keys(user), args=[symbol, int(short), int(quantity), repr(float(price))])
+
+        fills = []
+        for i in range(0, len(result), 3):
+            fills.append({
+                'quantity': int(float(result[i])),
+                'paid': float(result[i + 1]),
+                'net': float(result[i + 2]),
+            })
+
+        return fills
+
+    def close_all(self, user, prices):
+        """Close every lot of every symbol in `prices` (symbol -> price) in
+        one transaction. Returns the new cash balance and one row per
+        (symbol, side) that was closed."""
+        args = []
+        for symbol, price in prices.items():
+            args += [symbol, repr(float(price))]
+
+        result = self._close_all(keys=self.keys(user), args=args)
+
+        closed = []
+        for i in range(1, len(result), 5):
+            symbol = result[i].decode()
+            closed.append({
+                'symbol': symbol,
+                'short': result[i + 1] == b'1',
+                'quantity': int(float(result[i + 2])),
+                'basis': float(result[i + 3]),
+                'net': float(result[i + 4]),
+                'price': prices[symbol],
+            })
+
+        return float(result[0]), closed
+
+    def compact(self, user, age=COMPACT_AGE):
+        """Merge the lots of each (symbol, side) opened more than `age`
+        seconds ago into one, at their average price. Returns how many lots
+        went away."""
+        cutoff = datetime.datetime.now().timestamp() - age
+        return int(self._compact(keys=self.keys(user), args=[repr(cutoff)]))
+
+    def reset(self, user):
+        self._reset(keys=self.keys(user))
+
+    def held_symbols(self):
+        """Every symbol held by any player."""
+        if self.redis.exists('stonk_leaderboard:built'):
+            return {symbol.decode() for symbol in self.redis.smembers('stonk_held')}
+
+        symbols = set()
+        for key in self.redis.scan_iter(match='stonk_positions:*'):
+            try:
+                if self.redis.type(key) == b'string':
+                    lots = json.loads(self.redis.get(key))
+                else:
+                    lots = [json.loads(lot) for lot in self.redis.hvals(key)]
+            except Exception:
+                continue
+
+            symbols.update(lot['symbol'] for lot in lots)
+
+        return symbols
+
+    def rebuild_leaderboard(self):
+        """Recompute the leaderboard index from every player's cash and
+        holdings.
+
+        Only needed once for players that traded before the index existed;
+        after that every trade keeps it current.
+        """
+        self._rebuild(keys=['stonk_equity_base', 'stonk_held', 'stonk_leaderboard:built'])
+
+    def leaderboard(self, prices, count=10):
+        """Rank players by cash plus the market value of their positions.
+
+        `prices` maps every held symbol to its price; a symbol left out is
+        valued at zero. Returns the top `count` (or everyone, if None) as a
+        list of (user, equity).
+        """
+        if not self.redis.exists('stonk_leaderboard:built'):
+            self.rebuild_leaderboard()
+
+        weights = {'stonk_equity_base': 1}
+        for symbol, price in prices.items():
+            weights[f'stonk_exposure:{symbol}'] = price or 0
+
+        pipe = self.redis.pipeline()
+        pipe.zunionstore('stonk_leaderboard', weights)
+        pipe.zrevrange('stonk_leaderboard', 0, -1 if count is None else count - 1, withscores=True)
+        _, top = pipe.execute()
+
+        return [(user.decode(), equity) for user, equity in top]
@@ -0,0 +1,120 @@
+"""Background work that keeps the interactive path fast.
+
+Jobs are registered with `@periodic` and put on a Scheduler by `schedule`.
+Each one takes the Stocky instance, so it can get at the ledger and Redis.
+"""
+from functools import partial
+
+from tradingview import API, QuoteError, get_quotes, market
+from tradingview.cache import quote_cache
+from tradingview.charts import get_chart_cache
+from tradingview.metrics import span
+from tradingview.stream import get_stream
+from tradingview.symbols import directory
+from tradingview.technicals import technicals
+
+# Batch size for warming quotes; one quote session per batch.
+BATCH = 50
+
+# Quotes are prewarmed this often, and cached for long enough to last until
+# the next run even when that is late.
+PREWARM_INTERVAL = 30
+PREWARM_TTL = PREWARM_INTERVAL * 1.5
+
+registry = []
+
+
+def periodic(interval, jitter=0.1, when=None, shared=False):
+    """Register a job to run every `interval` seconds.
+
+    `shared` jobs do the same work whichever process runs them, so they are
+    claimed in Redis and only one process per interval does it.
+    """
+    def register(job):
+        registry.append((job, interval, jitter, when, shared))
+        return job
+    return register
+
+
+def trading_hours(now=None):
+    """Trading days, pre-market through after hours."""
+    return market.session(now) != 'closed'
+
+
+def claim(redis, name, interval):
+    return bool(redis.set(f'stonk_job:{name}', 1, nx=True, px=max(1, int(interval * 900))))
+
+
+@periodic(PREWARM_INTERVAL, when=trading_hours, shared=True)
+def prewarm_quotes(stocky):
+    """Quote everything held that the quote stream doesn't already have, and
+    cache it in Redis until the next run, so !portfolio and the leaderboard
+    hit the cache in every process."""
+    symbols = sorted(stocky.ledger.held_symbols())
+
+    stream = get_stream()
+    if stream is not None:
+        streamed = stream.get_many(symbols)
+        symbols = [symbol for symbol in symbols if symbol not in streamed]
+
+    # Straight to the socket: what's cached now would expire before the
+    # next run.
+    with API(None, cache=None) as api:
+        for i in range(0, len(symbols), BATCH):
+            quote_cache.set_many(api.getQuotes(symbols[i:i + BATCH]), min_ttl=PREWARM_TTL)
+
+
+@periodic(600, when=trading_hours)
+def refresh_technicals(stocky):
+    """Refetch held symbols' technicals before the cached ones expire."""
+    symbols = sorted(stocky.ledger.held_symbols())
+    exchanges = {}
+    for i in range(0, len(symbols), BATCH):
+        for symbol, quote in get_quotes(symbols[i:i + BATCH]).items():
+            if not isinstance(quote, QuoteError):
+                technicals.remember(symbol, quote.get('listed_exchange'))
+            if technicals.exchange(symbol):
+                exchanges[symbol] = technicals.exchange(symbol)
+
+    if exchanges:
+        technicals.get_many(exchanges, refresh=True)
+
+
+@periodic(300, when=trading_hours, shared=True)
+def snapshot_equity(stocky):
+    """Record everyone's equity for !history, off prices the quote stream
+    and prewarm_quotes keep fresh."""
+    stocky.snapshots.snapshot(stocky.getPrices(sorted(stocky.ledger.held_symbols())))
+
+
+@periodic(3600)
+def refresh_symbols(stocky):
+    """Redownload the symbol directory once a day, unless another process
+    sharing the file already has."""
+    directory.maybe_reload()
+    if directory.stale():
+        directory.refresh()
+
+
+@periodic(3600)
+def evict_charts(stocky):
+    get_chart_cache('assets').evict()
+
+
+@periodic(3600, shared=True)
+def compact_lots(stocky):
+    for key in stocky.redis.scan_iter(match='stonk_position_index:*'):
+        stocky.ledger.compact(key.decode()[len('stonk_position_index:'):])
+
+
+def _run(job, stocky, interval, shared):
+    if shared and not claim(stocky.redis, job.__name__, interval):
+        return
+
+    with span(f'job_{job.__name__}'):
+        job(stocky)
+
+
+def schedule(scheduler, stocky):
+    for job, interval, jitter, when, shared in registry:
+        scheduler.every(interval, partial(_run, job, stocky, interval, shared), name=job.__name__, jitter=jitter, when=when)
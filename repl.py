@@ -2,26 +2,23 @@ import os, sys, time
 from dotenv import load_dotenv
 from redis import Redis
 from pprint import pprint
-from parser import Parser
+from router import CommandError, UnknownSymbol
 
-from stocky import Stocky
+from stocky import Stocky, commands
 
 load_dotenv()
 
-parser = Parser()
 redis = Redis(host=os.environ.get('REDIS_HOST'), port=os.environ.get('REDIS_PORT'), db=os.environ.get('REDIS_DB'))
-stocky = Stocky(None, redis)
 
 
-def add(isbn):
-    return f'{isbn} was added'
+class Console:
+    """Stands in for the Slack client and prints what would be posted."""
 
-def delete(isbn):
-    return f'{isbn} was deleted'
+    def chat_postMessage(self, **kwargs):
+        pprint(kwargs)
 
 
-command_list = [add, delete]
-commands = {f.__name__: f for f in command_list}
+stocky = Stocky(Console(), redis)
 
 user = 'test_user' if len(sys.argv) != 2 else sys.argv[1]
 
@@ -42,13 +39,19 @@ while True:
         print('Goodbye!')
         break
 
-    parsed = parser.parse(command)
-    print(parsed)
-    if parsed is not None:
-        method = parsed[0]
-        if hasattr(stocky, method) and callable(getattr(stocky, method)):
-            func = getattr(stocky, method)
-            pprint(func(user, *parsed[1:]))
-            continue
+    try:
+        route = commands.match(command)
+    except UnknownSymbol as e:
+        print(f'Unknown symbol: {e.symbol}')
+        continue
+    except CommandError as e:
+        print(f'Usage: {e.usage}')
+        continue
+
+    print(route)
+    if route is not None:
+        commands.dispatch(stocky, {'user': user, 'channel': 'repl'}, route)
+        stocky.dispatcher.flush()
+        continue
 
     print('Unknown command.')
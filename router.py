@@ -0,0 +1,96 @@
+import re
+from collections import namedtuple
+
+from tradingview.symbols import directory
+
+
+SYMBOL_REGEX = re.compile(r'[A-Z\-\.]+')
+
+
+class CommandError(Exception):
+    def __init__(self, message, usage):
+        super().__init__(message)
+        self.usage = usage
+
+
+class UnknownSymbol(CommandError):
+    """A well formed symbol that isn't listed anywhere we know of."""
+
+    def __init__(self, symbol, usage=None):
+        super().__init__(f'{symbol} is not a listed symbol', usage)
+        self.symbol = symbol
+
+
+def symbol(value):
+    value = value.upper()
+    if not SYMBOL_REGEX.fullmatch(value):
+        raise ValueError(f'{value} is not a symbol')
+    if not directory.known(value):
+        raise UnknownSymbol(value)
+    return value
+
+
+Command = namedtuple('Command', ['name', 'method', 'params', 'usage'])
+Route = namedtuple('Route', ['command', 'args'])
+
+
+class Router:
+    """Table of `!commands` with their argument schemas.
+
+    Anything that doesn't start with the prefix is turned away after looking
+    at one character, and known commands are a dict lookup away. Arguments are
+    checked and coerced before the handler is ever called.
+    """
+
+    def __init__(self, prefix='!'):
+        self.prefix = prefix
+        self.commands = {}
+
+    def register(self, name, method=None, **params):
+        """Register `!name`, dispatched to `method` (defaults to `name`) with
+        positional arguments coerced by the callables in `params`."""
+        usage = ' '.join([f'{self.prefix}{name}'] + [f'[{param}]' for param in params])
+        self.commands[name] = Command(name, method or name, list(params.items()), usage)
+
+    def match(self, line):
+        """Returns a Route, or None if `line` isn't a command we know.
+
+        Raises CommandError if it is one of ours but the arguments are wrong,
+        UnknownSymbol if they're fine but name a symbol that isn't listed.
+        """
+        if not line:
+            return None
+
+        if line[0] != self.prefix:
+            if not line[0].isspace():
+                return None
+            line = line.lstrip()
+            if line[:1] != self.prefix:
+                return None
+
+        parts = line[1:].split()
+        if not parts:
+            return None
+
+        command = self.commands.get(parts[0])
+        if command is None:
+            return None
+
+        args = parts[1:]
+        if len(args) != len(command.params):
+            raise CommandError(f'{command.name} takes {len(command.params)} arguments', command.usage)
+
+        coerced = []
+        for value, (param, coerce) in zip(args, command.params):
+            try:
+                coerced.append(coerce(value))
+            except UnknownSymbol as e:
+                e.usage = command.usage
+                raise
+            except (TypeError, ValueError):
+                raise CommandError(f'{value} is not a valid {param}', command.usage)
+
+        return Route(command, coerced)
+
+    def dispatch(self, target, event, route):
+        return getattr(target, route.command.method)(event, *route.args)
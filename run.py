@@ -1,80 +1,235 @@
 #!/usr/bin/env python3
 import os
-import re
-import json
 import logging
-import random
-import requests
-import time
 import threading
-from cachetools import TTLCache
+from functools import partial
 from dotenv import load_dotenv
-from flask import Flask, send_from_directory
+from flask import Flask, Response, jsonify, send_from_directory
 from redis import Redis
 from slack import WebClient
 from slackeventsapi import SlackEventAdapter
-from math import sin, cos, sqrt, atan2, radians
 
-from parser import Parser
-from stocky import Stocky
+from dispatcher import Dispatcher
+from periodic import schedule
+from router import CommandError, UnknownSymbol
+from stocky import Stocky, commands
+from timer import get_scheduler
+from workers import JobQueue
+from tradingview.cache import quote_cache, quote_ttl
+from tradingview.charts import get_chart_cache
+from tradingview.lazy import imported, start_preload
+from tradingview.metrics import family, registry, span
+from tradingview.pool import get_pool
+from tradingview.stream import start_stream
+from tradingview.symbols import directory
+from tradingview.technicals import technicals
 
-load_dotenv()
+logger = logging.getLogger()
 
-app = Flask(__name__)
+DEDUPE_TTL = 480
 
-dupecache = TTLCache(maxsize=128, ttl=480)
 
-parser = Parser()
-slack_events_adapter = SlackEventAdapter(os.environ.get('SLACK_EVENTS_TOKEN'), '/slack/events/', app)
-slack_web_client = WebClient(token=os.environ.get('SLACK_TOKEN'))
-redis = Redis(host=os.environ.get('REDIS_HOST'), port=os.environ.get('REDIS_PORT'), db=os.environ.get('REDIS_DB'))
+def is_duplicate(redis, key):
+    """Claim an event id across every worker; False only for the first claim."""
+    if not key:
+        return False
 
-@slack_events_adapter.on('message')
-def message(payload):
-    logger.info(payload)
-    event = payload.get('event', {})
+    return not redis.set(f'stonk_event:{key}', 1, nx=True, ex=DEDUPE_TTL)
 
-    # Prevent answering the same slack message?
-    if event.get('client_msg_id') in dupecache:
-        return
-    dupecache[event.get('client_msg_id')] = True
 
-    # Never reply to another bot!
-    if event.get('bot_id', False):
+def handle_event(stocky, event):
+    # Check for commands
+    try:
+        route = commands.match(event.get('text'))
+    except UnknownSymbol as e:
+        stocky.postMessage(
+            channel=event.get('channel'),
+            text=f'Never heard of {e.symbol}. Unknown symbol, check your ticker.'
+        )
+        return
+    except CommandError as e:
+        stocky.postMessage(
+            channel=event.get('channel'),
+            text=f'Get your inputs right or you won\'t get anywhere in life. Try `{e.usage}`.'
+        )
         return
 
-    # Check for commands
-    parsed = parser.parse(event.get('text'))
-    if parsed is not None:
-        method = parsed[0]
-
-        # See if the command exists in Stocky
-        if hasattr(stocky, method) and callable(getattr(stocky, method)):
-            func = getattr(stocky, method)
-            try:
-                func(event, *parsed[1:])
-            except:
-                slack_web_client.chat_postMessage(
-                    channel=event.get('channel'),
-                    text='Get your inputs right or you won\'t get anywhere in life.'
-                )
-            return
+    if route is not None:
+        try:
+            with span(f'command_{route.command.name}'):
+                commands.dispatch(stocky, event, route)
+        except:
+            stocky.postMessage(
+                channel=event.get('channel'),
+                text='Get your inputs right or you won\'t get anywhere in life.'
+            )
+        return
 
 
     # See if there are stock quotes to look up!
     stocky.check_quotes(event)
 
 
-@app.route('/assets/<path:path>')
-def send_charts(path):
-    return send_from_directory('assets', path)
+def collect_metrics(chart_cache, jobs, dispatcher):
+    """Prometheus lines for the numbers the caches and queues already keep."""
+    quotes = quote_cache.stats()
+    charts = chart_cache.stats()
+    tech = technicals.stats()
+    queue = jobs.stats()
+    slack = dispatcher.stats()
+
+    return family('stonk_cache_lookups_total', 'Cache lookups by result.', 'counter', [
+        ({'cache': 'quote', 'result': 'hit'}, quotes['hits']),
+        ({'cache': 'quote', 'result': 'redis_hit'}, quotes['redis_hits']),
+        ({'cache': 'quote', 'result': 'coalesced'}, quotes['coalesced']),
+        ({'cache': 'quote', 'result': 'miss'}, quotes['misses']),
+        ({'cache': 'chart', 'result': 'hit'}, charts['hits']),
+        ({'cache': 'chart', 'result': 'redis_hit'}, charts['redis_hits']),
+        ({'cache': 'chart', 'result': 'miss'}, charts['misses']),
+        ({'cache': 'technicals', 'result': 'hit'}, tech['hits']),
+        ({'cache': 'technicals', 'result': 'miss'}, tech['misses']),
+    ]) + family('stonk_jobs_total', 'Slack events by outcome.', 'counter', [
+        ({'result': 'submitted'}, queue['submitted']),
+        ({'result': 'rejected'}, queue['rejected']),
+        ({'result': 'completed'}, queue['completed']),
+        ({'result': 'failed'}, queue['failed']),
+    ]) + family('stonk_job_queue_depth', 'Slack events waiting for a worker.', 'gauge', [
+        ({}, queue['depth']),
+    ]) + family('stonk_slack_messages_total', 'Outbound Slack messages by outcome.', 'counter', [
+        ({'result': 'queued'}, slack['queued']),
+        ({'result': 'posted'}, slack['posted']),
+        ({'result': 'merged'}, slack['merged']),
+        ({'result': 'rate_limited'}, slack['rate_limited']),
+        ({'result': 'failed'}, slack['failed']),
+        ({'result': 'split'}, slack['split']),
+        ({'result': 'dropped'}, slack['dropped']),
+    ]) + family('stonk_slack_queue_depth', 'Slack messages waiting to be posted.', 'gauge', [
+        ({}, slack['depth']),
+    ])
+
+
+def create_app():
+    """Build the Flask app and everything behind it.
+
+    Everything shared between workers (dedupe, cash, positions, the second
+    quote cache tier) lives in Redis, so this can be run by as many gunicorn
+    workers on as many hosts as needed:
+
+        gunicorn -w 4 'run:create_app()'
+    """
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    slack_events_adapter = SlackEventAdapter(os.environ.get('SLACK_EVENTS_TOKEN'), '/slack/events/', app)
+    slack_web_client = WebClient(token=os.environ.get('SLACK_TOKEN'))
+    redis = Redis(host=os.environ.get('REDIS_HOST'), port=os.environ.get('REDIS_PORT'), db=os.environ.get('REDIS_DB'))
+
+    quote_cache.configure(
+        redis=redis if os.environ.get('QUOTE_CACHE_REDIS', '1') == '1' else None,
+        ttl=partial(quote_ttl, regular=float(os.environ.get('QUOTE_CACHE_TTL', 5)), extended=float(os.environ.get('QUOTE_CACHE_EXTENDED_TTL', 30))),
+        redis_ttl=float(os.environ['QUOTE_CACHE_REDIS_TTL']) if 'QUOTE_CACHE_REDIS_TTL' in os.environ else None,
+    )
+
+    directory.path = os.environ.get('SYMBOL_DIRECTORY', directory.path)
+    directory.screeners = os.environ.get('SYMBOL_SCREENERS', ','.join(directory.screeners)).split(',')
+    directory.start()
+
+    chart_cache = get_chart_cache('assets')
+    chart_cache.max_bytes = int(os.environ.get('CHART_CACHE_MAX_BYTES', chart_cache.max_bytes))
+    chart_cache.max_age = int(os.environ.get('CHART_CACHE_MAX_AGE', chart_cache.max_age))
+    # Charts go into Redis too, so whichever host Slack fetches one from has it.
+    chart_cache.redis = redis if os.environ.get('CHART_CACHE_REDIS', '1') == '1' else None
+    chart_cache.redis_ttl = int(os.environ.get('CHART_CACHE_REDIS_TTL', chart_cache.redis_ttl))
+
+    dispatcher = Dispatcher(slack_web_client, workers=int(os.environ.get('SLACK_SENDERS', 2)))
+    stocky = Stocky(slack_web_client, redis, dispatcher)
+
+    # Import the charting stack and TA client in the background once we're
+    # serving, rather than on the first lookup that needs them.
+    warm = partial(start_preload, delay=float(os.environ.get('WARM_START_DELAY', 1)))
+    warm_start = os.environ.get('WARM_START', '1') == '1'
+
+    jobs = JobQueue(
+        partial(handle_event, stocky),
+        workers=int(os.environ.get('WORKERS', 4)),
+        maxsize=int(os.environ.get('JOB_QUEUE_SIZE', 100)),
+        mode=os.environ.get('WORKER_MODE', 'thread'),
+        initializer=warm if warm_start else None,
+    )
+
+    @slack_events_adapter.on('message')
+    def message(payload):
+        logger.info(payload)
+        event = payload.get('event', {})
+
+        # Nothing to do for edits, joins and other text-less events.
+        if not event.get('text') or not event.get('channel'):
+            return
 
+        # Never reply to another bot!
+        if event.get('bot_id', False):
+            return
 
-if __name__ == '__main__':
-    stocky = Stocky(slack_web_client, redis)
+        # Prevent answering the same slack message, even if a retry lands on
+        # another worker.
+        if is_duplicate(redis, event.get('client_msg_id') or payload.get('event_id')):
+            return
+
+        # Ack Slack right away; the slow part happens on a worker.
+        if not jobs.submit(event):
+            logger.warning(f'Job queue full, dropping message {event.get("client_msg_id")}')
+
+
+    @app.route('/assets/<path:path>')
+    def send_charts(path):
+        chart_cache.pull(path)
+        return send_from_directory('assets', path)
 
-    logger = logging.getLogger()
+
+    @app.route('/stats')
+    def stats():
+        return jsonify({
+            'quotes': quote_cache.stats(),
+            'charts': chart_cache.stats(),
+            'technicals': technicals.stats(),
+            'jobs': jobs.stats(),
+            'slack': dispatcher.stats(),
+            'scheduler': get_scheduler().stats(),
+            'symbols': directory.stats(),
+            'imports': imported,
+        })
+
+    @app.route('/metrics')
+    def metrics():
+        lines = registry.render() + collect_metrics(chart_cache, jobs, dispatcher)
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    jobs.start()
+
+    # After the workers are forked, so none of them inherits a half done import.
+    if warm_start:
+        warm()
+
+    # Open the TradingView sockets now rather than on the first lookup.
+    threading.Thread(target=get_pool().warm, daemon=True).start()
+
+    if os.environ.get('QUOTE_STREAM', '1') == '1':
+        start_stream(stocky.ledger.held_symbols)
+
+    # Warm-up and housekeeping, off the interactive path.
+    if os.environ.get('SCHEDULER', '1') == '1':
+        schedule(get_scheduler(), stocky)
+
+    app.config['stocky'] = stocky
+    app.config['jobs'] = jobs
+    app.config['dispatcher'] = dispatcher
+
+    return app
+
+
+if __name__ == '__main__':
     logger.setLevel(logging.DEBUG)
     logger.addHandler(logging.StreamHandler())
 
-    app.run('0.0.0.0', port='10312')
+    create_app().run('0.0.0.0', port='10312')
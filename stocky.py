@@ -1,14 +1,42 @@
-import datetime, json, math, re
-from tradingview import API as TradingViewAPI
+import datetime, math, re
+from dispatcher import MAX_BLOCKS, Dispatcher
+from history import History
+from ledger import Ledger
+from router import Router, symbol
+from tradingview import API as TradingViewAPI, QuoteError, get_quotes, lookup, market
+from tradingview.charts import get_chart_cache
+from tradingview.sparkline import render_sparkline
+from tradingview.symbols import directory
 
 QUOTE_REGEX = r'\$([A-Z\-\.]+)'
-
-STARTUP_CASH = 100000.00
+ASSETS = './assets'
+ASSETS_URL = 'http://sublim.nl:10312/assets'
+
+commands = Router()
+commands.register('help')
+commands.register('funds')
+commands.register('portfolio')
+commands.register('buy', quantity=int, symbol=symbol)
+commands.register('sell', quantity=int, symbol=symbol)
+commands.register('short', quantity=int, symbol=symbol)
+commands.register('cover', quantity=int, symbol=symbol)
+commands.register('liquidate')
+commands.register('leaderboard')
+commands.register('history')
+commands.register('bankruptcy')
 
 class Stocky:
-    def __init__(self, client, redis):
+    def __init__(self, client, redis, dispatcher=None):
         self.client = client
         self.redis = redis
+        self.ledger = Ledger(redis)
+        self.snapshots = History(redis, self.ledger)
+        self.dispatcher = dispatcher or Dispatcher(client)
+
+    def postMessage(self, **kwargs):
+        # Queued; posting happens in the background so handlers never wait on Slack.
+        self.dispatcher.post(**kwargs)
+
 
     def getPriceEmoji(self, change):
         if change >= 0:
@@ -30,21 +58,23 @@ class Stocky:
             sell = 'N/A'
 
 
-        if 'current_session' not in data and data.keys() >= {'short_name', 'description', 'rtc', 'rch', 'rchp', 'rch'}:
-            data['current_session'] = True
-        elif 'current_session' not in data:
+        if not data.keys() >= {'short_name', 'description', 'lp'}:
             print('Some weird issue:')
             print(data)
             return 'There was an error retrieving this symbol; try again later?'
 
-        if data['current_session'] == 'pre_market':
+        session = data.get('current_session') or market.session()
+        if session in ('pre_market', 'post_market') and not data.keys() >= {'rtc', 'rch', 'rchp'}:
+            session = 'market'
+
+        if session == 'pre_market':
             return '\n'.join([
                 f'<https://finance.yahoo.com/quote/{data["short_name"]}|{data["description"]} ({data["short_name"]})>',
                 f'>At Close: *{data["lp"]}* USD _{format(data["ch"], ".2f")} ({format(data["chp"], ".2f")}%)_ {self.getPriceEmoji(data["ch"])}',
                 f'>Pre-Market: *{data["rtc"]}* USD _{format(data["rch"], ".2f")} ({format(data["rchp"], ".2f")}%)_ {self.getPriceEmoji(data["rch"])}',
                 f'_1 Day Technical Analysis: *{reco.title()}* (Buy: {buy}, Neutral: {neutral}, Sell: {sell})_'
                 ])
-        elif data['current_session'] == 'post_market':
+        elif session == 'post_market':
             return '\n'.join([
                 f'<https://finance.yahoo.com/quote/{data["short_name"]}|{data["description"]}> ({data["short_name"]})>',
                 f'>At Close: *{data["lp"]}* USD _{format(data["ch"], ".2f")} ({format(data["chp"], ".2f")}%)_ {self.getPriceEmoji(data["ch"])}',
@@ -58,6 +88,28 @@ class Stocky:
                 f'_1 Day Technical Analysis: *{reco.title()}* (Buy: {buy}, Neutral: {neutral}, Sell: {sell})_'
             ])
 
+    def getPrices(self, symbols):
+        """Price several symbols in one round trip; failures map to None."""
+        prices = {}
+        if not symbols:
+            return prices
+
+        try:
+            quotes = get_quotes(symbols)
+        except Exception as e:
+            print('Unable to getquotes!')
+            print(e)
+            return {symbol: None for symbol in symbols}
+
+        for symbol, quote in quotes.items():
+            try:
+                prices[symbol] = float(quote['lp'] if 'lp' in quote else quote['rtc'])
+            except:
+                prices[symbol] = None
+
+        return prices
+
+
     def help(self, event):
         commands = [
             '  !funds                - See your available funds.',
@@ -67,65 +119,55 @@ class Stocky:
             '  !short [qty] [ticker] - Short [qty] shares of [ticker] stonk at market price.',
             '  !cover [qty] [ticker] - Cover [qty] shares of [ticker] stonk at market price.',
             '  !liquidate            - Sell and cover all shares you own at the market price.',
+            '  !leaderboard          - See who is winning at stonks.',
+            '  !history              - See how your stonks have done over time.',
             '  !bankruptcy           - File for bankruptcy and reset your funds and portfolio.'
         ]
-        self.client.chat_postMessage(
+        self.postMessage(
             channel=event.get('channel'),
             text=f'For now I know stonks - so if you want to play stonks, you\'ve come to the right place.\n```' + '\n'.join(commands) + '```'
         )
 
 
     def funds(self, event):
-        if not self.redis.exists(f'stonk_cash:{event.get("user")}'):
-            self.redis.set(f'stonk_cash:{event.get("user")}', STARTUP_CASH)
-            funds = STARTUP_CASH
-        else:
-            funds = float(self.redis.get(f'stonk_cash:{event.get("user")}').decode())
+        funds = self.ledger.cash(event.get('user'))
 
-        self.client.chat_postMessage(
+        self.postMessage(
             channel=event.get('channel'),
             text=f'<@{event.get("user")}> has {"${:,.2f}".format(funds)} for investing.'
         )
 
 
     def portfolio(self, event):
-        positions = self.redis.get(f'stonk_positions:{event.get("user")}')
-        if positions is None:
-            positions = []
-        else:
-            positions = json.loads(positions.decode())
-            positions.sort(key=lambda p: p['symbol'])
+        holdings = self.ledger.holdings(event.get('user'))[1]
+        holdings.sort(key=lambda h: (h['symbol'], h['short']))
 
         gains = 0.0
         total = 0.0
         results = ["%5s | %8s | %8s | %12s | %12s | %12s | %12s" % (
-                'Type', 'Symbol', 'Qty', 'Price Paid', 'Last Price', 'Value', 'Gain'
+                'Type', 'Symbol', 'Qty', 'Avg Paid', 'Last Price', 'Value', 'Gain'
         ),
         '-' * 87]
 
-        for position in positions:
-            try:
-                api = TradingViewAPI(position['symbol'])
-                quote = api.getQuote(tech=False)
-                price = float(quote['lp'] if 'lp' in quote else quote['rtc'])
-                api.close()
-            except:
-                # Was the symbol delisted? Or just temp glitch
-                price = 0.0
+        prices = self.getPrices([holding['symbol'] for holding in holdings])
+
+        for holding in holdings:
+            # Was the symbol delisted? Or just temp glitch
+            price = prices.get(holding['symbol']) or 0.0
 
 
-            if position['short']:
-                net = position['quantity'] * (position['price'] - price)
+            if holding['short']:
+                net = holding['cost'] - holding['quantity'] * price
             else:
-                net = position['quantity'] * (price - position['price'])
+                net = holding['quantity'] * price - holding['cost']
 
-            value = position['quantity'] * position['price']
+            value = holding['cost']
 
             results.append("%5s | %8s | %8s | %12s | %12s | %12s | %12s" % (
-                'Short' if position['short'] else 'Long',
-                position['symbol'],
-                position['quantity'],
-                f'{"${:,.2f}".format(position["price"])}',
+                'Short' if holding['short'] else 'Long',
+                holding['symbol'],
+                holding['quantity'],
+                f'{"${:,.2f}".format(holding["price"])}',
                 f'{"${:,.2f}".format(price)}',
                 f'{"${:,.2f}".format(value)}',
                 f'{"${:,.2f}".format(net)}',
@@ -141,12 +183,12 @@ class Stocky:
         ))
 
         if len(results) > 2:
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'<@{event.get("user")}>\'s portfolio:\n' + '```' + '\n'.join(results) + '```'
             )
         else:
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'<@{event.get("user")}>, your portfolio is empty! Buy! Buy! Buy!'
             )
@@ -158,7 +200,7 @@ class Stocky:
         response = self._create_position(event, symbol, quantity)
 
         if response and response['status'] == 'ok':
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'<@{response["user"]}> bought {response["quantity"]} shares of {response["symbol"]} at {"${:,.2f}".format(response["price"])}.'
             )
@@ -171,8 +213,8 @@ class Stocky:
     def short(self, event, quantity, symbol):
         response = self._create_position(event, symbol, quantity, short=True)
 
-        if response['status'] == 'ok':
-            self.client.chat_postMessage(
+        if response and response['status'] == 'ok':
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'<@{response["user"]}> shorted {response["quantity"]} shares of {response["symbol"]} at {"${:,.2f}".format(response["price"])}.'
             )
@@ -187,65 +229,38 @@ class Stocky:
             quantity = int(quantity)
             symbol = symbol.upper()
             if not price:
-                api = TradingViewAPI(symbol)
-                price = float(api.getQuote(tech=False)['lp'])
-                api.close()
+                with TradingViewAPI(symbol) as api:
+                    price = float(api.getQuote(tech=False)['lp'])
             else:
                 price = float(price)
         except:
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text='Is that even a real stock symbol? Perhaps I am just having trouble finding it at the moment... but let\'s be real - it\'s probably your fault.'
             )
             return
 
         if quantity <= 0:
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'How do you expect to do anything with {quantity} shares?'
             )
             return
 
-        if not self.redis.exists(f'stonk_cash:{event.get("user")}'):
-            self.redis.set(f'stonk_cash:{event.get("user")}', STARTUP_CASH)
-
-        positions = self.redis.get(f'stonk_positions:{event.get("user")}')
-        if positions is None:
-            positions = []
-        else:
-            positions = json.loads(positions.decode())
-
-        cost = price * quantity
+        response = self.ledger.open(event.get('user'), symbol, quantity, price, short=short)
 
+        if response['status'] == 'funds':
+            available = math.floor(response['cash'] / price)
 
-        funds = float(self.redis.get(f'stonk_cash:{event.get("user")}').decode())
-        if cost > funds:
-            available = math.floor(funds / price)
-
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'<@{event.get("user")}> You don\'t have enough funds to complete this -- at most you could do {available} shares.'
             )
             return
 
-        position = {
-            'symbol': symbol,
-            'price': price,
-            'quantity': quantity,
-            'date': datetime.datetime.now().timestamp(),
-            'short': short
-        }
-        positions.append(position)
-
-        self.redis.set(f'stonk_cash:{event.get("user")}', float(self.redis.get(f'stonk_cash:{event.get("user")}').decode()) - cost)
-        self.redis.set(f'stonk_positions:{event.get("user")}', json.dumps(positions))
-
-        self.redis.get('cash:{event.get("user")}')
-
         return {
-            'status': 'ok',
             'user': event.get("user"),
-            **position
+            **response
         }
 
 
@@ -255,85 +270,159 @@ class Stocky:
             quantity = int(quantity)
             symbol = symbol.upper()
             if not price:
-                api = TradingViewAPI(symbol)
-                price = float(api.getQuote(tech=False)['lp'])
-                api.close()
+                with TradingViewAPI(symbol) as api:
+                    price = float(api.getQuote(tech=False)['lp'])
             else:
                 price = float(price)
         except:
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text='Is that even a real stock symbol? Perhaps I am just having trouble finding it at the moment... but let\'s be real - it\'s probably your fault.'
             )
             return
 
         if quantity <= 0:
-            self.client.chat_postMessage(
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'How do you expect to do anything with {quantity} shares?'
             )
             return
 
-        positions = json.loads(self.redis.get(f'stonk_positions:{event.get("user")}').decode())
-        check = []
-        keep = []
-        for position in positions:
-            if symbol == position['symbol'] and short == position['short']:
-                check.append(position)
-            else:
-                keep.append(position)
+        fills = self.ledger.close(event.get('user'), symbol, quantity, price, short=short)
 
-        if not check:
-            self.client.chat_postMessage(
+        if not fills:
+            self.postMessage(
                 channel=event.get('channel'),
                 text=f'{symbol} is not even in your portfolio!'
             )
             return
 
-        check.sort(key=lambda p: p['date'])
+        for fill in fills:
+            self.postMessage(
+                channel=event.get('channel'),
+                text=f'<@{event.get("user")}> {"covered" if short else "sold"} {fill["quantity"]} shares of {symbol} at {"${:,.2f}".format(price)} (net: {"${:,.2f}".format(fill["net"])})'
+            )
+
 
-        for position in check:
-            q = min(quantity, position['quantity'])
+    def liquidate(self, event):
+        holdings = self.ledger.holdings(event.get('user'))[1]
+        if not holdings:
+            return
 
-            basis = position['price'] * q
-            value = price * q
+        prices = self.getPrices([holding['symbol'] for holding in holdings])
+        failed = sorted(symbol for symbol, price in prices.items() if not price)
 
-            if short:
-                net = basis - value
-                self.redis.set(f'stonk_cash:{event.get("user")}', float(self.redis.get(f'stonk_cash:{event.get("user")}').decode()) + basis + net)
-            else:
-                net = value - basis
-                self.redis.set(f'stonk_cash:{event.get("user")}', float(self.redis.get(f'stonk_cash:{event.get("user")}').decode()) + value)
+        cash, closed = self.ledger.close_all(event.get('user'), {symbol: price for symbol, price in prices.items() if price})
+        closed.sort(key=lambda c: (c['symbol'], c['short']))
 
-            quantity -= q
-            position['quantity'] -= q
+        results = ["%5s | %8s | %8s | %12s | %12s | %12s" % (
+                'Type', 'Symbol', 'Qty', 'Price', 'Proceeds', 'Net'
+        ),
+        '-' * 72]
+
+        net = 0.0
+        for row in closed:
+            results.append("%5s | %8s | %8s | %12s | %12s | %12s" % (
+                'Short' if row['short'] else 'Long',
+                row['symbol'],
+                row['quantity'],
+                f'{"${:,.2f}".format(row["price"])}',
+                f'{"${:,.2f}".format(row["basis"] + row["net"])}',
+                f'{"${:,.2f}".format(row["net"])}',
+            ))
 
-            if position['quantity'] > 0:
-                keep.append(position)
+            net += row['net']
 
-            self.client.chat_postMessage(
-                channel=event.get('channel'),
-                text=f'<@{event.get("user")}> {"covered" if position["short"] else "sold"} {q} shares of {symbol} at {"${:,.2f}".format(price)} (net: {"${:,.2f}".format(net)})'
-            )
+        results.append("%44s %12s | %12s" % (
+            '', 'Total net:',
+            f'{"${:,.2f}".format(net)}'
+        ))
 
-        self.redis.set(f'stonk_positions:{event.get("user")}', json.dumps(keep))
+        lines = []
+        if closed:
+            lines.append(f'<@{event.get("user")}> liquidated their portfolio and now has {"${:,.2f}".format(cash)}:\n```' + '\n'.join(results) + '```')
+        if failed:
+            lines.append(f'Couldn\'t get a price for {", ".join(failed)}, so those positions are still open.')
 
+        self.postMessage(
+            channel=event.get('channel'),
+            text='\n'.join(lines)
+        )
 
-    def liquidate(self, event):
-        positions = self.redis.get(f'stonk_positions:{event.get("user")}')
-        if positions is None:
+        return closed
+
+
+    def leaderboard(self, event):
+        prices = self.getPrices(sorted(self.ledger.held_symbols()))
+        top = self.ledger.leaderboard(prices)
+        if not top:
             return
-        else:
-            positions = json.loads(positions.decode())
 
+        # Mentions don't render inside a code block, so no table here.
+        lines = ['Top stonkers by cash plus the market value of their portfolio:']
+        for rank, (user, equity) in enumerate(top, 1):
+            lines.append(f'>{rank}. <@{user}> {"${:,.2f}".format(equity)}')
 
-        for position in positions:
-            self._close_position(event, position['symbol'], position['quantity'], price=None, short=position['short'])
+        failed = sorted(symbol for symbol, price in prices.items() if not price)
+        if failed:
+            lines.append(f'Couldn\'t get a price for {", ".join(failed)}, so those count for nothing.')
+
+        self.postMessage(
+            channel=event.get('channel'),
+            text='\n'.join(lines)
+        )
+
+
+    def history(self, event):
+        user = event.get('user')
+        series = self.snapshots.series(user)
+        if len(series) < 2:
+            self.postMessage(
+                channel=event.get('channel'),
+                text=f'<@{user}>, there\'s no history for you yet. Check back once the market has been open a while.'
+            )
+            return
+
+        # Charted from the snapshots alone; nothing gets quoted.
+        equity = series[:, 3]
+        change = equity[-1] - equity[0]
+        since = datetime.datetime.fromtimestamp(series[0, 0], market.EST)
+
+        block = {
+            'type': 'section',
+            'text': {
+                'type': 'mrkdwn',
+                'text': '\n'.join([
+                    f'<@{user}>\'s equity since {since:%b %-d, %Y}:',
+                    f'>Now: *{"${:,.2f}".format(equity[-1])}* _{"${:,.2f}".format(change)} ({format(change / equity[0] * 100 if equity[0] else 0, ".2f")}%)_ {self.getPriceEmoji(change)}',
+                    f'>High: {"${:,.2f}".format(equity.max())}, Low: {"${:,.2f}".format(equity.min())}',
+                    f'>Cash: {"${:,.2f}".format(series[-1, 1])}, Positions: {"${:,.2f}".format(series[-1, 2])}',
+                ]),
+            }
+        }
+
+        color = 'green' if change >= 0 else 'red'
+        try:
+            img = get_chart_cache(ASSETS).get(f'history-{user}', equity, color, lambda save_to: render_sparkline(equity, color, save_to))
+            block['accessory'] = {
+                'type': 'image',
+                'image_url': f'{ASSETS_URL}/{img}',
+                'alt_text': f'Equity chart for {user}'
+            }
+        except Exception as e:
+            print('Unable to chart history!')
+            print(e)
+
+        self.postMessage(
+            channel=event.get('channel'),
+            blocks=[ block ],
+            unfurl_links=False,
+            unfurl_media=False
+        )
 
 
     def bankruptcy(self, event):
-        self.redis.delete(f'stonk_cash:{event.get("user")}')
-        self.redis.delete(f'stonk_positions:{event.get("user")}')
+        self.ledger.reset(event.get('user'))
 
         def getSuffix(num):
             if 4 <= num <= 20 or 24 <= num <= 30:
@@ -343,7 +432,7 @@ class Stocky:
 
         dt = datetime.datetime.now()
 
-        self.client.chat_postMessage(
+        self.postMessage(
             channel=event.get('channel'),
             text=f'<!channel> Notice is hereby given, that on the {f"{dt.day}{getSuffix(dt.day)} day of {dt:%B}, A. D. {dt.year}"}, <@{event.get("user")}> was duly adjudicated bankrupt. If they owed you anything, tough shit.'
         )
@@ -355,44 +444,48 @@ class Stocky:
         except:
             return
 
+        # Turn away "$USD" and the like without going to TradingView.
+        matches = [match for match in matches if directory.known(match)]
         if not matches:
             return
 
-        for quote in matches:
-            api = TradingViewAPI(quote)
+        # Quotes, charts and technicals for every symbol at once.
+        try:
+            results = lookup(matches, ASSETS)
+        except Exception as e:
+            print('Unable to getquotes!')
+            print(e)
+            return
 
-            try:
-                data = api.getQuote()
-            except Exception as e:
+        blocks = []
+        for quote, result in results.items():
+            data = result.quote
+            if isinstance(data, QuoteError):
                 print('Unable to getquote!')
-                print(e)
+                print(data)
                 continue
 
             block = {
                 'type': 'section',
-                'block_id': f'{api.quote_session}',
                 'text': {
                     'type': 'mrkdwn',
                     'text': self.getPriceBlock(data),
                 }
             }
 
-            try:
-                chart_data = api.getChart()
-                img = api.generateChartImage('./assets', chart_data, data['ch'])
+            if result.image is not None:
                 block['accessory'] = {
                     'type': 'image',
-                    'image_url': f'http://sublim.nl:10312/assets/{img}',
-                    'alt_text': f'Spark chart for {data["short_name"]}'
+                    'image_url': f'{ASSETS_URL}/{result.image}',
+                    'alt_text': f'Spark chart for {data.get("short_name", quote)}'
                 }
-            except:
-                pass
 
-            api.close()
+            blocks.append(block)
 
-            self.client.chat_postMessage(
+        for i in range(0, len(blocks), MAX_BLOCKS):
+            self.postMessage(
                 channel=event.get('channel'),
-                blocks=[ block ],
+                blocks=blocks[i:i + MAX_BLOCKS],
                 unfurl_links=False,
                 unfurl_media=False
             )
@@ -1,39 +1,201 @@
-from threading import Timer
+import heapq, itertools, os, random, threading, traceback
+from time import monotonic
+
+
+class Job:
+    """A function the Scheduler runs every `interval` seconds."""
+
+    def __init__(self, name, target, interval, jitter=0.0, when=None):
+        self.name = name
+        self.target = target
+        self.interval = interval
+        self.jitter = jitter
+        self.when = when
+
+        self.scheduled = None
+        self.next_run = None
+        self.cancelled = False
+        self.is_running = False
+
+        self.runs = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.failures = 0
+        self.last_duration = None
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'failures': self.failures,
+            'last_duration': self.last_duration,
+        }
+
+
+class Scheduler:
+    """Runs periodic jobs from a heap on a single thread.
+
+    Each run is pushed back by up to `jitter` (a fraction of the interval) so
+    jobs that share an interval don't all fire at once. Jobs never overlap:
+    one that takes longer than its interval is counted as an overrun and its
+    next run is one interval after it finished, rather than a burst of runs
+    to catch up. `when` is an optional callable; the run is skipped, not
+    delayed, while it returns False.
+    """
+
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self.jobs = {}
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def every(self, interval, target, name=None, jitter=0.1, first=None, when=None):
+        """Run `target()` every `interval` seconds, first after `first`
+        seconds (default: one interval)."""
+        job = Job(name or target.__name__, target, interval, jitter, when)
+        with self._cond:
+            if job.name in self.jobs:
+                self.jobs[job.name].cancelled = True
+            self.jobs[job.name] = job
+            self._push(job, monotonic() + (interval if first is None else first))
+        return job
+
+    def cancel(self, job):
+        with self._cond:
+            job.cancelled = True
+            if self.jobs.get(job.name) is job:
+                del self.jobs[job.name]
+            self._cond.notify()
+
+    def _push(self, job, when):
+        job.scheduled = when
+        job.next_run = when + random.uniform(0, job.jitter * job.interval)
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        self._cond.notify()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+
+                    wait = self._heap[0][0] - monotonic() if self._heap else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._cond.wait(wait)
+
+                if self._stopped:
+                    return
+
+                job = heapq.heappop(self._heap)[2]
+
+            self._execute(job)
+
+            with self._cond:
+                if not job.cancelled:
+                    # Missed ticks are dropped, not made up.
+                    now = monotonic()
+                    following = job.scheduled + job.interval
+                    self._push(job, following if following > now else now + job.interval)
+
+    def _execute(self, job):
+        try:
+            due = job.when is None or job.when()
+        except Exception:
+            # A broken guard is the job failing, not a reason to kill the
+            # scheduler thread.
+            job.failures += 1
+            print(f'Unable to check job {job.name}!')
+            traceback.print_exc()
+            return
+
+        if not due:
+            job.skipped += 1
+            return
+
+        job.is_running = True
+        start = monotonic()
+        try:
+            job.target()
+        except Exception:
+            job.failures += 1
+            print(f'Unable to run job {job.name}!')
+            traceback.print_exc()
+        finally:
+            job.is_running = False
+            job.last_duration = monotonic() - start
+            job.runs += 1
+            if job.last_duration > job.interval:
+                job.overruns += 1
+
+    def stats(self):
+        with self._cond:
+            return {name: job.stats() for name, job in self.jobs.items()}
+
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, started and ready for jobs."""
+    global _scheduler, _scheduler_pid
+
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = Scheduler()
+            _scheduler_pid = os.getpid()
+            _scheduler.start()
+
+    return _scheduler
 
 
 class InfiniteTimer():
-    """A Timer class that does not stop, unless you want it to."""
+    """A Timer class that does not stop, unless you want it to.
+
+    Runs on the shared scheduler rather than a thread per tick.
+    """
 
     def __init__(self, seconds, target):
-        self._should_continue = False
-        self.is_running = False
         self.seconds = seconds
         self.target = target
-        self.thread = None
+        self.job = None
 
-    def _handle_target(self):
-        self.is_running = True
-        self.target()
-        self.is_running = False
-        self._start_timer()
-
-    def _start_timer(self):
-        if self._should_continue: # Code could have been running when cancel was called.
-            self.thread = Timer(self.seconds, self._handle_target)
-            self.thread.start()
+    @property
+    def is_running(self):
+        return self.job is not None and self.job.is_running
 
     def start(self):
-        if not self._should_continue and not self.is_running:
-            self._should_continue = True
-            self._start_timer()
-            self.target()
+        if self.job is None:
+            self.job = get_scheduler().every(self.seconds, self.target, name=f'timer-{id(self)}', jitter=0, first=0)
         else:
             print("Timer already started or running, please wait if you're restarting.")
 
     def cancel(self):
-        if self.thread is not None:
-            self._should_continue = False # Just in case thread is running and cancel fails.
-            self.thread.cancel()
+        if self.job is not None:
+            get_scheduler().cancel(self.job)
+            self.job = None
         else:
             print("Timer never started or failed to initialize.")
-
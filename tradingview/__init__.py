@@ -1 +1 @@
-from tradingview.api import API
+from tradingview.api import API, AsyncAPI, QuoteError, get_quotes, lookup
@@ -1,42 +1,102 @@
-import json, os, pytz, random, re, string
-from websocket import create_connection
-from datetime import datetime, time, timedelta
-from PIL import Image
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-from tradingview_ta import TA_Handler, Interval
+import asyncio, random, string
+from collections import namedtuple
+from functools import partial
+from time import monotonic, time
 
+from tradingview import market, metrics
+from tradingview.cache import QuoteCache, quote_cache
+from tradingview.charts import get_chart_cache
+from tradingview.exceptions import QuoteError
+from tradingview.helpers.protocol import FrameDecoder, construct_message, prepend_header
+from tradingview.lazy import lazy
+from tradingview.market import session_start
+from tradingview.metrics import span
+from tradingview.pool import CONNECTION_ERRORS, get_pool
+from tradingview.sparkline import SPARKLINE_SIZE, render_sparkline
+from tradingview.stream import get_stream
+from tradingview.technicals import technicals
 
-EST = pytz.timezone('US/Eastern')
+np = lazy('numpy')
+
+
+Series = namedtuple('Series', ['time', 'open', 'high', 'low', 'close', 'volume'])
 
 
-def filter_date(date):
-    timestamp = datetime.fromtimestamp(date)
-    local = EST.localize(timestamp)
 
-    if time() < time(9,30):
-        yesterday = datetime.today().date() - timedelta(days=1)
-        if local.date() == yesterday:
-            return True
+def series_ttl(series, regular=30, extended=60):
+    """Today's bars hold briefly during regular hours and until the open while
+    the market is shut, unless they're still coming in (crypto, FX)."""
+    if len(series.time) and series.time[-1] > time() - 600:
+        return regular
+    return market.ttl(regular, extended)
 
-    if local.date() < datetime.today().date():
-        return False
 
-    return True
+series_cache = QuoteCache(maxsize=128, ttl=series_ttl)
+
+# Seconds a batch of quotes or a chart gets to finish loading, heartbeats or
+# not.
+QUOTE_TIMEOUT = 10
+CHART_TIMEOUT = 15
+
+
+def filter_date(date):
+    return date >= session_start()
+
+
+def get_quotes(symbols, tech=False, pool=None):
+    """Fetch quotes for several symbols in a single round trip."""
+    with API(None, pool=pool) as api:
+        return api.getQuotes(symbols, tech=tech)
 
 
 class API:
-    def __init__(self, symbol):
-        headers = json.dumps({
-            'Origin': 'https://data.tradingview.com'
-        })
-        self.ws = create_connection('wss://data.tradingview.com/socket.io/websocket', headers=headers)
+    def __init__(self, symbol, pool=None, cache=quote_cache):
+        self.pool = pool or get_pool()
+        self.cache = cache
+        self.conn = None
         self.symbol = symbol
+        self.sessions = []
         self.quote_session = self.generateSession('qs_')
         self.chart_session = self.generateSession('cs_')
 
 
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    @property
+    def ws(self):
+        return self.connection().ws
+
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = self.pool.acquire()
+
+        return self.conn
+
+
+    def reconnect(self):
+        self.pool.release(self.conn, discard=True)
+        self.conn = None
+        self.sessions = []
+
+        return self.connection()
+
+
+    def request(self, func, *args, **kwargs):
+        # Pooled sockets can go stale between uses; retry once on a fresh one.
+        try:
+            return func(*args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.reconnect()
+            return func(*args, **kwargs)
+
+
     def generateSession(self, prefix):
         stringLength = 12
         letters = string.ascii_lowercase
@@ -45,14 +105,11 @@ class API:
 
 
     def prependHeader(self, m):
-        return '~m~' + str(len(m)) + '~m~' + m
+        return prepend_header(m)
 
 
     def constructMessage(self, func, params):
-        return json.dumps({
-            'm': func,
-            'p': params,
-        }, separators=(',', ':'))
+        return construct_message(func, params)
 
 
     def createMessage(self, func, params):
@@ -60,124 +117,331 @@ class API:
 
 
     def sendMessage(self, func, args):
-        self.ws.send(self.createMessage(func, args))
+        self.connection().send(func, args)
 
 
     def close(self):
-        self.ws.close()
+        if self.conn is None:
+            return
+
+        # Hand the socket back for the next lookup, minus our sessions.
+        try:
+            for func, session in self.sessions:
+                self.conn.send(func, [session])
+        except CONNECTION_ERRORS:
+            self.pool.release(self.conn, discard=True)
+        else:
+            self.pool.release(self.conn)
+
+        self.conn = None
+        self.sessions = []
 
 
     def parseMessage(self, m):
-        lines = re.split(r'~m~[0-9]+~m~', m)
-        for i in range(len(lines)):
+        return FrameDecoder().feed(m)[0]
+
+
+    def getQuote(self, tech=True):
+        data = self.getQuotes([self.symbol], tech=tech)[self.symbol]
+        if isinstance(data, QuoteError):
+            raise data
+
+        return data
+
+
+    def getQuotes(self, symbols, tech=False):
+        """Returns a dict of symbol to quote data, or to a QuoteError if that
+        symbol could not be fetched."""
+        symbols = list(dict.fromkeys(symbols))
+
+        # Symbols we already know the exchange of can have their technicals
+        # fetched while we wait on the quotes.
+        known = {}
+        pending = None
+        if tech:
+            known = {symbol: technicals.exchange(symbol) for symbol in symbols if technicals.exchange(symbol)}
+            if known:
+                pending = technicals.submit(known)
+
+        # Hot symbols are already streaming into memory; only go out for the rest.
+        streamed = {}
+        stream = get_stream()
+        if stream is not None:
+            stream.touch(symbols)
+            streamed = stream.get_many(symbols)
+
+        cold = [symbol for symbol in symbols if symbol not in streamed]
+        if not cold:
+            fetched = {}
+        elif self.cache is None:
+            fetched = self.request(self._fetchQuotes, cold)
+        else:
+            fetched = self.cache.get_many(cold, lambda missing: self.request(self._fetchQuotes, missing))
+
+        results = {symbol: streamed[symbol] if symbol in streamed else fetched[symbol] for symbol in symbols}
+
+        if tech:
+            self._addTechnicals(results, known, pending)
+
+        return results
+
+
+    def _addTechnicals(self, results, known, pending):
+        rest = {}
+        for symbol, data in results.items():
+            if isinstance(data, QuoteError):
+                continue
+
+            technicals.remember(symbol, data.get('listed_exchange'))
+            if symbol not in known and technicals.exchange(symbol):
+                rest[symbol] = technicals.exchange(symbol)
+
+        summaries = technicals.get_many(rest) if rest else {}
+
+        if pending is not None:
             try:
-                lines[i] = json.loads(lines[i])
+                summaries.update(pending.result(timeout=technicals.timeout))
             except Exception as e:
-                lines[i] = {}
+                print('Unable to get technicals!')
+                print(e)
 
-        return lines
+        for symbol, summary in summaries.items():
+            if not isinstance(results[symbol], QuoteError):
+                results[symbol]['technicals'] = summary
 
 
-    def getQuote(self, tech=True):
-        self.sendMessage('set_data_quality', ['low'])
-        self.sendMessage('set_auth_token', ['unauthorized_user_token'])
+    @span('quotes')
+    def _fetchQuotes(self, symbols):
+        self.quote_session = self.generateSession('qs_')
         self.sendMessage('quote_create_session', [self.quote_session])
-        self.sendMessage('quote_add_symbols', [self.quote_session, self.symbol, {'flags': ['force_permission']}])
+        self.sessions.append(('quote_delete_session', self.quote_session))
+        self.sendMessage('quote_add_symbols', [self.quote_session, *symbols, {'flags': ['force_permission']}])
+
+        data = {symbol: {} for symbol in symbols}
+        errors = {}
+        updates = {symbol: 0 for symbol in symbols}
+        pending = set(symbols)
+        # A silent socket raises out of messages() so request() can retry on
+        # a fresh one; a chatty one that never completes runs into the
+        # deadline, and whatever is still pending times out.
+        deadline = monotonic() + QUOTE_TIMEOUT
+        while pending and monotonic() < deadline:
+            result = self.connection().messages()
 
-        receiving = True
-        cnt = 0
-        data = {}
-        while receiving:
-            result = self.parseMessage(self.ws.recv())
             for resp in result:
-                if 'm' not in resp:
+                # Skip frames left over from earlier sessions on a pooled socket.
+                if 'm' not in resp or resp['p'][0] != self.quote_session:
                     continue
 
                 if resp['m'] == 'quote_completed':
-                    receiving = False
-                    break
+                    pending.discard(resp['p'][1])
+                    continue
 
-                if resp['p'][1]['s'] == 'error':
-                    raise Exception()
+                if resp['m'] != 'qsd':
+                    continue
 
-                data.update(resp['p'][1]['v'])
+                symbol = resp['p'][1]['n']
+                if symbol not in data:
+                    continue
 
-                cnt = cnt + 1
-                if cnt > 3:
-                    receiving = False
-                    break
+                if resp['p'][1]['s'] == 'error':
+                    metrics.errors.inc(stage='quote')
+                    errors[symbol] = QuoteError(f'Unable to get a quote for {symbol}')
+                    pending.discard(symbol)
+                    continue
 
-        if tech:
-            try:
-                technicals = TA_Handler(
-                    symbol=self.symbol,
-                    screener='america',
-                    exchange=data['listed_exchange'],
-                    interval=Interval.INTERVAL_1_DAY
-                )
+                data[symbol].update(resp['p'][1]['v'])
 
-                data['technicals'] = technicals.get_analysis().summary
-            except:
-                pass
+                updates[symbol] += 1
+                if updates[symbol] > 3:
+                    pending.discard(symbol)
 
-        return data
+        for symbol in symbols:
+            if symbol not in errors and not data[symbol]:
+                metrics.errors.inc(stage='quote')
+                errors[symbol] = QuoteError(f'Timed out waiting for a quote for {symbol}')
+
+        return {symbol: errors.get(symbol, data[symbol]) for symbol in symbols}
 
 
     def getChart(self):
+        return self.getSeries().close
+
+
+    def getSeries(self):
+        if self.cache is None:
+            return self.request(self._fetchChart)
+
+        series = series_cache.get_many([self.symbol], lambda missing: {self.symbol: self.request(self._fetchChart)})[self.symbol]
+        if isinstance(series, QuoteError):
+            raise series
+
+        return series
+
+
+    @span('chart')
+    def _fetchChart(self):
         self.sendMessage('chart_create_session', [self.chart_session])
+        self.sessions.append(('chart_delete_session', self.chart_session))
         self.sendMessage('switch_timezone', [self.chart_session, 'Etc/UTC'])
         self.sendMessage('resolve_symbol', [self.chart_session, 'symbol_1', f'={{"symbol":"{self.symbol}","adjustment":"splits","session":"extended"}}'])
         self.sendMessage('create_series', [self.chart_session, 's1', 's1', 'symbol_1', '3', 300])
 
+        deadline = monotonic() + CHART_TIMEOUT
         receiving = True
         chart_data = []
         while receiving:
-            result = self.parseMessage(self.ws.recv())
+            if monotonic() > deadline:
+                raise QuoteError(f'Timed out waiting for a chart for {self.symbol}')
+
+            result = self.connection().messages()
 
             for resp in result:
                 if 'm' not in resp or resp['m'] in ['series_loading', 'symbol_resolved']:
                     continue
 
+                if resp['p'][0] != self.chart_session:
+                    continue
+
                 if resp['m'] == 'series_completed':
                     receiving = False
                     break
 
+                if resp['m'] in ['symbol_error', 'series_error']:
+                    raise QuoteError(f'Unable to get a chart for {self.symbol}')
+
                 try:
                     chart_data = resp['p'][1]['s1']['s']
                 except:
                     pass
 
-        points = [ i['v'][4] for i in chart_data if filter_date(i['v'][0]) ]
+        # Indices and FX have no volume column.
+        bars = np.array([bar['v'][:6] + [np.nan] * (6 - len(bar['v'])) for bar in chart_data], dtype=np.float64).reshape(-1, 6)
+        bars = bars[bars[:, 0] >= session_start()]
 
-        return points
+        return Series(*bars.T)
 
 
-    def generateChartImage(self, path, data, chg, figsize=(10, 10), **kwargs):
-        save_to = os.path.join(path, f'{self.chart_session}.png')
+    def generateChartImage(self, path, data, chg, size=SPARKLINE_SIZE):
+        color = 'green' if chg >= 0 else 'red'
 
-        fig,ax = plt.subplots(1, 1, figsize=figsize, **kwargs)
+        def render(save_to):
+            with span('render'):
+                render_sparkline(data, color, save_to, size=size)
 
-        if chg >= 0:
-            ax.plot(data, 'g-')
-            color = 'green'
-        else:
-            ax.plot(data, 'r-')
-            color = 'red'
+        return get_chart_cache(path).get(self.symbol, data, color, render)
+
+
+Lookup = namedtuple('Lookup', ['quote', 'image'])
+
+
+class AsyncAPI:
+    """Looks up several symbols at once on asyncio.
+
+    The quotes go out in one batch while every symbol's chart is fetched on a
+    socket of its own, and technicals for symbols we already know the
+    exchange of run alongside both. Each chart is rendered as soon as its
+    quote and bars are in. The socket work is the same blocking, pooled code
+    API uses, run on the event loop's executor, at most `concurrency` pieces
+    at a time.
+    """
+
+    def __init__(self, pool=None, cache=quote_cache, concurrency=8):
+        self.pool = pool
+        self.cache = cache
+        self.concurrency = concurrency
+        self._slots = None
+
+    async def _run(self, func, *args, **kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    def _quotes(self, symbols):
+        with API(None, pool=self.pool, cache=self.cache) as api:
+            return api.getQuotes(symbols)
+
+    def _series(self, symbol):
+        with API(symbol, pool=self.pool, cache=self.cache) as api:
+            return api.getSeries()
+
+    async def getQuotes(self, symbols):
+        return await self._run(self._quotes, symbols)
+
+    async def getSeries(self, symbol):
+        return await self._run(self._series, symbol)
+
+    async def getTechnicals(self, symbols):
+        """`symbols` maps symbol -> exchange."""
+        return await self._run(technicals.get_many, symbols) if symbols else {}
 
-        for k, v in ax.spines.items():
-            v.set_visible(False)
+    async def generateChartImage(self, symbol, path, data, chg):
+        return await self._run(API(symbol, pool=self.pool).generateChartImage, path, data, chg)
 
-        ax.set_xticks([])
-        ax.set_yticks([])
+    async def _chart(self, symbol, path, quotes):
+        # The bars are fetched alongside the quote, and dropped unfetched if
+        # it turns out there is nothing to chart.
+        series = asyncio.ensure_future(self.getSeries(symbol))
+        try:
+            quote = (await quotes)[symbol]
+            if isinstance(quote, QuoteError):
+                return None
+            return await self.generateChartImage(symbol, path, (await series).close, quote.get('ch', 0))
+        except Exception as e:
+            print(f'Unable to chart {symbol}!')
+            print(e)
+            return None
+        finally:
+            series.cancel()
 
-        plt.plot(len(data)-1, data[len(data)-1], 'r.')
+    async def lookup(self, symbols, path=None, tech=True):
+        """Returns symbol -> Lookup(quote or QuoteError, chart file name or
+        None), in the order asked. Charts are only made with a `path` to
+        put them in."""
+        symbols = list(dict.fromkeys(symbols))
 
-        ax.fill_between(range(len(data)), data, len(data) * [min(data)], alpha=0.1, color=color)
+        known = {symbol: technicals.exchange(symbol) for symbol in symbols if tech and technicals.exchange(symbol)}
+        early = asyncio.ensure_future(self.getTechnicals(known))
 
-        plt.savefig(save_to, bbox_inches='tight')
+        quotes = asyncio.ensure_future(self.getQuotes(symbols))
+        charts = {}
+        if path is not None:
+            for symbol in symbols:
+                charts[symbol] = asyncio.ensure_future(self._chart(symbol, path, quotes))
 
-#        im = Image.open(save_to)
-#        newim = im.resize((250, 250))
-#        newim.save(save_to, 'PNG')
+        quotes = await quotes
 
-        return f'{self.chart_session}.png'
+        rest = {}
+        for symbol, quote in quotes.items():
+            if tech and not isinstance(quote, QuoteError):
+                technicals.remember(symbol, quote.get('listed_exchange'))
+                if symbol not in known and technicals.exchange(symbol):
+                    rest[symbol] = technicals.exchange(symbol)
+
+        summaries = {}
+        for result in await asyncio.gather(early, self.getTechnicals(rest), return_exceptions=True):
+            if isinstance(result, Exception):
+                print('Unable to get technicals!')
+                print(result)
+            else:
+                summaries.update(result)
+
+        images = dict(zip(charts, await asyncio.gather(*charts.values())))
+
+        results = {}
+        for symbol in symbols:
+            quote = quotes[symbol]
+            if symbol in summaries and not isinstance(quote, QuoteError):
+                quote['technicals'] = summaries[symbol]
+            results[symbol] = Lookup(quote, images.get(symbol))
+
+        return results
+
+
+def lookup(symbols, path=None, tech=True, pool=None):
+    """Quote, chart and technicals for several symbols at once, from
+    synchronous code. See AsyncAPI.lookup."""
+    with span('lookup'):
+        return asyncio.run(AsyncAPI(pool=pool).lookup(symbols, path, tech=tech))
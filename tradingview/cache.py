@@ -0,0 +1,212 @@
+import json, threading
+from collections import OrderedDict
+from time import monotonic
+
+from tradingview.exceptions import QuoteError
+from tradingview.market import ttl as market_ttl
+
+
+class _Flight:
+    """A fetch in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+    def finish(self, result):
+        self.result = result
+        self.done.set()
+
+
+class QuoteCache:
+    """Short lived quote cache that sits in front of the TradingView socket.
+
+    Lookups go to an in-process LRU first, then to an optional Redis tier that
+    is shared by every worker. Symbols that miss both are fetched, and a symbol
+    that is already being fetched by another thread is waited on rather than
+    fetched again.
+
+    `ttl` and `redis_ttl` are seconds, or callables that are given each quote
+    as it is cached and return its seconds, so they can follow the market.
+    """
+
+    def __init__(self, maxsize=256, ttl=5, redis=None, redis_ttl=None, wait=15, prefix='stonk_quote:'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+        self.wait = wait
+        self.prefix = prefix
+
+        self._local = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def configure(self, **kwargs):
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError(f'QuoteCache has no setting {key}')
+            setattr(self, key, value)
+
+    def stats(self):
+        lookups = self.hits + self.redis_hits + self.misses + self.coalesced
+        return {
+            'size': len(self._local),
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _ttl(self, data):
+        ttl = self.ttl(data) if callable(self.ttl) else self.ttl
+        redis_ttl = self.redis_ttl(data) if callable(self.redis_ttl) else self.redis_ttl
+        return ttl, redis_ttl or ttl
+
+    def _get_local(self, symbol):
+        entry = self._local.get(symbol)
+        if entry is None:
+            return None
+
+        expires, data = entry
+        if expires < monotonic():
+            del self._local[symbol]
+            return None
+
+        self._local.move_to_end(symbol)
+        return data
+
+    def _set_local(self, symbol, data, ttl=None, min_ttl=0):
+        self._local[symbol] = (monotonic() + max(ttl or self._ttl(data)[0], min_ttl), data)
+        self._local.move_to_end(symbol)
+
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    def _get_redis(self, symbols):
+        if self.redis is None or not symbols:
+            return {}
+
+        try:
+            values = self.redis.mget([f'{self.prefix}{symbol}' for symbol in symbols])
+        except Exception as e:
+            print('Unable to read quote cache from redis!')
+            print(e)
+            return {}
+
+        return {symbol: json.loads(value) for symbol, value in zip(symbols, values) if value is not None}
+
+    def _set_redis(self, quotes, ttl=None, min_ttl=0):
+        if self.redis is None or not quotes:
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for symbol, data in quotes.items():
+                pipe.set(f'{self.prefix}{symbol}', json.dumps(data), px=int(max(ttl or self._ttl(data)[1], min_ttl) * 1000))
+            pipe.execute()
+        except Exception as e:
+            print('Unable to write quote cache to redis!')
+            print(e)
+
+    def set(self, symbol, data, ttl=None):
+        with self._lock:
+            self._set_local(symbol, data, ttl)
+        self._set_redis({symbol: data}, ttl)
+
+    def set_many(self, quotes, min_ttl=0):
+        """Cache quotes fetched elsewhere, each for its usual TTL but at least
+        `min_ttl` seconds. QuoteErrors are left out."""
+        quotes = {symbol: data for symbol, data in quotes.items() if not isinstance(data, QuoteError)}
+        with self._lock:
+            for symbol, data in quotes.items():
+                self._set_local(symbol, data, min_ttl=min_ttl)
+        self._set_redis(quotes, min_ttl=min_ttl)
+
+    def get_many(self, symbols, fetch):
+        """Returns a dict of symbol to quote data (or QuoteError).
+
+        `fetch` is called with the list of symbols nobody has cached or is
+        already fetching, and must return the same kind of dict.
+        """
+        results = {}
+
+        with self._lock:
+            for symbol in symbols:
+                data = self._get_local(symbol)
+                if data is not None:
+                    results[symbol] = data
+                    self.hits += 1
+
+        remaining = [symbol for symbol in symbols if symbol not in results]
+        shared = self._get_redis(remaining)
+        if shared:
+            with self._lock:
+                for symbol, data in shared.items():
+                    self._set_local(symbol, data)
+                    results[symbol] = data
+                    self.redis_hits += 1
+
+        claimed = {}
+        waiting = {}
+        with self._lock:
+            for symbol in symbols:
+                if symbol in results:
+                    continue
+
+                if symbol in self._inflight:
+                    waiting[symbol] = self._inflight[symbol]
+                    self.coalesced += 1
+                else:
+                    claimed[symbol] = self._inflight[symbol] = _Flight()
+                    self.misses += 1
+
+        if claimed:
+            fetched = {}
+            try:
+                fetched = fetch(list(claimed))
+            except Exception as e:
+                fetched = {symbol: QuoteError(str(e)) for symbol in claimed}
+                raise
+            finally:
+                good = {symbol: data for symbol, data in fetched.items() if not isinstance(data, QuoteError)}
+                with self._lock:
+                    for symbol, data in good.items():
+                        self._set_local(symbol, data)
+                    for symbol, flight in claimed.items():
+                        del self._inflight[symbol]
+                        flight.finish(fetched.get(symbol))
+
+            self._set_redis(good)
+            results.update(fetched)
+
+        for symbol, flight in waiting.items():
+            if not flight.done.wait(self.wait) or flight.result is None:
+                results[symbol] = QuoteError(f'Timed out waiting for a quote for {symbol}')
+            else:
+                results[symbol] = flight.result
+
+        # Callers decorate quotes (technicals, session), so hand out copies.
+        return {symbol: dict(results[symbol]) if isinstance(results[symbol], dict) else results[symbol] for symbol in symbols}
+
+
+def quote_ttl(quote, regular=5, extended=30):
+    """Seconds during regular hours, half a minute around them, and until the
+    next pre-market open while the market is shut. Symbols that are trading
+    anyway (crypto, FX, other exchanges) keep the regular TTL."""
+    if quote.get('current_session') == 'market':
+        return regular
+    return market_ttl(regular, extended)
+
+
+quote_cache = QuoteCache(ttl=quote_ttl)
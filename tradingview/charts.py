@@ -0,0 +1,208 @@
+import hashlib, json, os, re, threading
+from time import monotonic, time
+
+
+class ChartCache:
+    """Content addressed store for rendered charts.
+
+    Files are named after the symbol and a hash of everything that goes into
+    the image, so a repeat lookup of an unchanged chart reuses the file that
+    is already on disk. The directory is kept under `max_bytes` and files
+    older than `max_age` seconds are removed.
+
+    With `redis`, every rendered chart is also kept there for `redis_ttl`
+    seconds under its file name, so a host that didn't render a chart can
+    still serve it (`pull`) or reuse it instead of rendering it again.
+    """
+
+    # Bump when the renderer changes so old images are not reused.
+    version = 2
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, max_age=7 * 24 * 3600, evict_every=3600,
+                 redis=None, redis_ttl=24 * 3600, prefix='stonk_chart:'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.disk_bytes = None
+        self.last_evict = None
+
+        self._lock = threading.Lock()
+
+    def key(self, symbol, points, color):
+        digest = hashlib.sha1()
+        digest.update(str(self.version).encode())
+        digest.update(symbol.encode())
+        digest.update(color.encode())
+        digest.update(points.tobytes() if hasattr(points, 'tobytes') else json.dumps(list(points)).encode())
+        return digest.hexdigest()[:20]
+
+    def filename(self, symbol, key):
+        return f'{re.sub(r"[^A-Za-z0-9.-]", "_", symbol)}-{key}.png'
+
+    def _write(self, save_to, write):
+        os.makedirs(self.path, exist_ok=True)
+
+        tmp = f'{save_to}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            write(tmp)
+            os.replace(tmp, save_to)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        with self._lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += os.path.getsize(save_to)
+
+        self.maybe_evict()
+
+    def _get_redis(self, name):
+        if self.redis is None:
+            return None
+
+        try:
+            return self.redis.get(f'{self.prefix}{name}')
+        except Exception as e:
+            print('Unable to read chart from redis!')
+            print(e)
+            return None
+
+    def _set_redis(self, name, save_to):
+        if self.redis is None:
+            return
+
+        try:
+            with open(save_to, 'rb') as f:
+                self.redis.set(f'{self.prefix}{name}', f.read(), ex=int(self.redis_ttl))
+        except Exception as e:
+            print('Unable to write chart to redis!')
+            print(e)
+
+    def _from_redis(self, name, save_to):
+        data = self._get_redis(name)
+        if data is None:
+            return False
+
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(data)
+
+        self._write(save_to, write)
+        return True
+
+    def pull(self, name):
+        """Make sure chart `name` is on disk, copying it from Redis if another
+        host rendered it. Returns whether it is there."""
+        if not re.fullmatch(r'[A-Za-z0-9._-]+\.png', name):
+            return False
+
+        save_to = os.path.join(self.path, name)
+        return os.path.exists(save_to) or self._from_redis(name, save_to)
+
+    def get(self, symbol, points, color, render):
+        """Returns the file name for this chart, calling `render(save_to)` only
+        if an identical chart isn't already on disk."""
+        name = self.filename(symbol, self.key(symbol, points, color))
+        save_to = os.path.join(self.path, name)
+
+        if os.path.exists(save_to):
+            # Bump the mtime so eviction treats it as recently used.
+            try:
+                os.utime(save_to)
+                self.hits += 1
+                return name
+            except FileNotFoundError:
+                pass
+
+        if self._from_redis(name, save_to):
+            self.redis_hits += 1
+            return name
+
+        self.misses += 1
+        self._write(save_to, render)
+        self._set_redis(name, save_to)
+
+        return name
+
+    def _files(self):
+        files = []
+        try:
+            entries = os.scandir(self.path)
+        except FileNotFoundError:
+            return files
+
+        with entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return files
+
+    def maybe_evict(self):
+        with self._lock:
+            due = self.last_evict is None or monotonic() - self.last_evict > self.evict_every
+            full = self.disk_bytes is not None and self.disk_bytes > self.max_bytes
+
+        if due or full:
+            self.evict()
+
+    def evict(self):
+        """Remove expired charts, then the least recently used ones until the
+        directory fits in `max_bytes`."""
+        with self._lock:
+            files = sorted(self._files())
+            cutoff = time() - self.max_age
+            total = sum(size for _, size, _ in files)
+
+            for mtime, size, path in files:
+                if mtime >= cutoff and total <= self.max_bytes:
+                    break
+
+                try:
+                    os.remove(path)
+                    self.evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+            self.disk_bytes = total
+            self.last_evict = monotonic()
+
+    def stats(self):
+        files = self._files()
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+            'evicted': self.evicted,
+            'files': len(files),
+            'disk_bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_chart_cache(path):
+    """Return the shared cache for a given assets directory."""
+    path = os.path.abspath(path)
+
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ChartCache(path)
+
+        return _caches[path]
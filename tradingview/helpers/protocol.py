@@ -0,0 +1,80 @@
+import json
+
+HEADER = '~m~'
+HEARTBEAT = '~h~'
+
+
+def prepend_header(m):
+    return HEADER + str(len(m)) + HEADER + m
+
+
+def construct_message(func, params):
+    return json.dumps({
+        'm': func,
+        'p': params,
+    }, separators=(',', ':'))
+
+
+def create_message(func, params):
+    return prepend_header(construct_message(func, params))
+
+
+class FrameDecoder:
+    """Streaming decoder for TradingView's `~m~<len>~m~<payload>` framing.
+
+    Websocket messages can carry several frames, and a frame can in theory be
+    split over several messages, so anything incomplete is kept until the
+    next `feed`. Lengths are in characters, same as what we send.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        """Returns (messages, heartbeats): decoded JSON payloads and the raw
+        heartbeat payloads that have to be echoed back."""
+        buffer = self.buffer + data if self.buffer else data
+        messages = []
+        heartbeats = []
+
+        pos = 0
+        end = len(buffer)
+        while pos < end:
+            if not buffer.startswith(HEADER, pos):
+                # Header split across messages.
+                if HEADER.startswith(buffer[pos:]):
+                    break
+
+                # Lost sync; skip ahead to the next header.
+                found = buffer.find(HEADER, pos + 1)
+                pos = found if found >= 0 else max(pos + 1, end - 2)
+                continue
+
+            sep = buffer.find(HEADER, pos + 3)
+            if sep < 0:
+                break
+
+            try:
+                length = int(buffer[pos + 3:sep])
+            except ValueError:
+                pos = sep
+                continue
+
+            start = sep + 3
+            if start + length > end:
+                break
+
+            payload = buffer[start:start + length]
+            pos = start + length
+
+            first = payload[:1]
+            if first == '{' or first == '[':
+                try:
+                    messages.append(json.loads(payload))
+                except ValueError:
+                    pass
+            elif payload.startswith(HEARTBEAT):
+                heartbeats.append(payload)
+
+        self.buffer = buffer[pos:]
+        return messages, heartbeats
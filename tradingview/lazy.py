@@ -0,0 +1,67 @@
+"""Heavy dependencies, imported on first use.
+
+numpy, Pillow and tradingview_ta take longer to import than everything else
+the bot needs, and most commands (!funds, !buy, ...) never touch them.
+Modules bind them with `lazy(name)` instead of importing them, and the import
+happens the first time an attribute is looked up. `start_preload` does it
+ahead of time, in the background, so the first chart doesn't pay for it.
+"""
+import importlib, sys, threading
+from time import perf_counter, sleep
+
+
+HEAVY = ['numpy', 'PIL.Image', 'PIL.ImageDraw', 'tradingview_ta']
+
+# name -> seconds its import took, for the ones we ended up doing.
+imported = {}
+
+
+def load(name):
+    # Always through importlib, even when it's in sys.modules: that may be a
+    # half initialized module another thread is still importing, and
+    # importlib waits for it to finish.
+    if name in sys.modules:
+        return importlib.import_module(name)
+
+    start = perf_counter()
+    module = importlib.import_module(name)
+    imported.setdefault(name, perf_counter() - start)
+    return module
+
+
+class LazyModule:
+    """Stands in for a module until something is looked up on it."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = load(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+
+def lazy(name):
+    return LazyModule(name)
+
+
+def preload(names=HEAVY, delay=0):
+    """Import `names` now, so no request has to."""
+    sleep(delay)
+    for name in names:
+        try:
+            load(name)
+        except Exception as e:
+            print(f'Unable to preload {name}!')
+            print(e)
+
+
+def start_preload(names=HEAVY, delay=0):
+    thread = threading.Thread(target=preload, args=(names, delay), name='preload', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,203 @@
+"""NYSE trading calendar: sessions, weekends and holidays.
+
+Each calendar day is worked out once, and the current session is kept until
+its next boundary, so asking for the session or the chart window in a hot
+loop is a float comparison.
+"""
+import pytz
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from time import time as _now
+
+
+EST = pytz.timezone('US/Eastern')
+
+PRE_MARKET = time(4)
+OPEN = time(9, 30)
+CLOSE = time(16)
+POST_MARKET = time(20)
+EARLY_CLOSE = time(13)
+EARLY_POST_MARKET = time(17)
+
+# Epoch seconds. For days the market is shut, only `midnight` is set.
+Day = namedtuple('Day', ['date', 'trading', 'midnight', 'pre', 'open', 'close', 'post', 'end'])
+
+# What holds from `start` until `until`.
+State = namedtuple('State', ['start', 'until', 'session', 'chart_start', 'next_open'])
+
+
+def _nth_weekday(year, month, weekday, n):
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year, month, weekday):
+    last = date(year, month + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day):
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    days = {
+        _nth_weekday(year, 1, 0, 3),        # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),        # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _last_weekday(year, 5, 0),          # Memorial Day
+        _observed(date(year, 7, 4)),        # Independence Day
+        _nth_weekday(year, 9, 0, 1),        # Labor Day
+        _nth_weekday(year, 11, 3, 4),       # Thanksgiving
+        _observed(date(year, 12, 25)),      # Christmas
+    }
+
+    # New Year's Day on a Saturday isn't made up on the Friday before.
+    if date(year, 1, 1).weekday() != 5:
+        days.add(_observed(date(year, 1, 1)))
+
+    if year >= 2022:
+        days.add(_observed(date(year, 6, 19)))
+
+    return frozenset(days)
+
+
+@lru_cache(maxsize=None)
+def early_closes(year):
+    days = {_nth_weekday(year, 11, 3, 4) + timedelta(days=1)}
+
+    # The day before Independence Day and Christmas Eve, when it's Mon-Thu.
+    for day in (date(year, 7, 3), date(year, 12, 24)):
+        if day.weekday() < 4:
+            days.add(day)
+
+    return frozenset(days)
+
+
+def _at(day, at):
+    return EST.localize(datetime.combine(day, at)).timestamp()
+
+
+@lru_cache(maxsize=1024)
+def get_day(day):
+    midnight = _at(day, time())
+    end = _at(day + timedelta(days=1), time())
+
+    if day.weekday() >= 5 or day in holidays(day.year):
+        return Day(day, False, midnight, None, None, None, None, end)
+
+    early = day in early_closes(day.year)
+    return Day(
+        day, True, midnight,
+        _at(day, PRE_MARKET),
+        _at(day, OPEN),
+        _at(day, EARLY_CLOSE if early else CLOSE),
+        _at(day, EARLY_POST_MARKET if early else POST_MARKET),
+        end,
+    )
+
+
+def _trading_day(day, step):
+    while True:
+        day += timedelta(days=step)
+        if get_day(day).trading:
+            return get_day(day)
+
+
+def _compute(ts):
+    today = get_day(datetime.fromtimestamp(ts, EST).date())
+
+    if not today.trading:
+        previous = _trading_day(today.date, -1)
+        return State(today.midnight, today.end, 'closed', previous.midnight, _trading_day(today.date, 1).pre)
+
+    # The chart shows today once the opening bell has rung, before that the
+    # previous session.
+    if ts < today.open:
+        chart_start = _trading_day(today.date, -1).midnight
+    else:
+        chart_start = today.midnight
+
+    bounds = [
+        (today.midnight, today.pre, 'closed'),
+        (today.pre, today.open, 'pre_market'),
+        (today.open, today.close, 'market'),
+        (today.close, today.post, 'post_market'),
+        (today.post, today.end, 'closed'),
+    ]
+    for start, until, session in bounds:
+        if start <= ts < until:
+            break
+
+    if ts < today.pre:
+        next_open = today.pre
+    else:
+        next_open = _trading_day(today.date, 1).pre
+
+    # The open and the pre-market open are both boundaries, so all of this
+    # holds until `until`.
+    return State(start, until, session, chart_start, next_open)
+
+
+_state = None
+
+
+def state(now=None):
+    """The session state for `now` (epoch seconds or an aware datetime;
+    default now). Precomputed until the next session boundary."""
+    global _state
+
+    ts = _now() if now is None else now.timestamp() if isinstance(now, datetime) else now
+    current = _state
+    if current is not None and current.start <= ts < current.until:
+        return current
+
+    current = _compute(ts)
+    if now is None:
+        _state = current
+    return current
+
+
+def session(now=None):
+    """'pre_market', 'market', 'post_market' or 'closed'."""
+    return state(now).session
+
+
+def session_start(now=None):
+    """Epoch seconds the chart window starts at: midnight ET of the current
+    trading day once it has opened, otherwise of the previous one."""
+    return state(now).chart_start
+
+
+def ttl(regular, extended=None, now=None):
+    """How long something fetched now stays good: `regular` seconds during
+    regular hours, `extended` (default `regular`) before and after, and until
+    the next pre-market open while the market is shut."""
+    current = state(now)
+    if current.session == 'market':
+        return regular
+    if current.session != 'closed':
+        return regular if extended is None else extended
+
+    ts = _now() if now is None else now.timestamp() if isinstance(now, datetime) else now
+    return max(regular, current.next_open - ts)
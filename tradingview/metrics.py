@@ -0,0 +1,127 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+# Prometheus' default buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # key -> [count per bucket..., count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_labels(names, key + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{_labels(names, key + ("+Inf",))} {counts[-2]}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, key)} {counts[-1]}')
+                lines.append(f'{self.name}_count{_labels(self.labels, key)} {counts[-2]}')
+        return lines
+
+
+class Registry:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Values are per process, same as `/stats`.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return lines
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    'stonk_stage_seconds', 'Time spent in each stage of answering a message.', ['stage'])
+errors = registry.counter(
+    'stonk_errors_total', 'Failures by stage.', ['stage'])
+
+
+@contextmanager
+def span(stage):
+    """Time the block into stonk_stage_seconds, and count it as an error if
+    it raises."""
+    start = perf_counter()
+    try:
+        yield
+    except BaseException:
+        errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(perf_counter() - start, stage=stage)
+
+
+def family(name, help, type, samples):
+    """Lines for a metric that is already counted elsewhere and only read at
+    scrape time; `samples` is a list of (labels dict, value)."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(list(labels), list(labels.values()))} {value}')
+    return lines
@@ -0,0 +1,147 @@
+import json, os, threading
+from collections import deque
+from time import monotonic
+from websocket import create_connection, WebSocketException
+
+from tradingview.helpers.protocol import FrameDecoder, create_message, prepend_header
+from tradingview.metrics import span
+
+
+WS_URL = 'wss://data.tradingview.com/socket.io/websocket'
+WS_HEADERS = json.dumps({
+    'Origin': 'https://data.tradingview.com'
+})
+
+# Errors that mean the socket is no good anymore and should be replaced.
+CONNECTION_ERRORS = (WebSocketException, ConnectionError, OSError)
+
+
+class Connection:
+    """A single authenticated TradingView websocket."""
+
+    @span('connect')
+    def __init__(self, url=WS_URL, timeout=10):
+        self.ws = create_connection(url, headers=WS_HEADERS, timeout=timeout)
+        self.decoder = FrameDecoder()
+        self.created = monotonic()
+        self.last_used = self.created
+
+        # Only needs to be done once per socket, not once per quote.
+        self.send('set_data_quality', ['low'])
+        self.send('set_auth_token', ['unauthorized_user_token'])
+
+    def send(self, func, args):
+        self.ws.send(create_message(func, args))
+        self.last_used = monotonic()
+
+    def recv(self):
+        m = self.ws.recv()
+        self.last_used = monotonic()
+        return m
+
+    def messages(self):
+        """Receive and decode the next websocket message, answering any
+        heartbeats in it. Returns the decoded JSON messages."""
+        messages, heartbeats = self.decoder.feed(self.recv())
+
+        for heartbeat in heartbeats:
+            self.ws.send(prepend_header(heartbeat))
+
+        return messages
+
+    @property
+    def connected(self):
+        return self.ws is not None and self.ws.connected
+
+    def close(self):
+        try:
+            self.ws.close()
+        except:
+            pass
+
+
+class ConnectionPool:
+    """Keeps a few TradingView sockets warm so lookups can skip the handshake.
+
+    Connections are handed out exclusively with `acquire` and must be given
+    back with `release`. A connection that failed mid-request should be
+    released with `discard=True`, so it gets closed rather than reused.
+    """
+
+    def __init__(self, size=3, max_idle=60, timeout=10, url=WS_URL):
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.url = url
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return Connection(self.url, timeout=self.timeout)
+
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.connected and monotonic() - conn.last_used < self.max_idle:
+                    return conn
+                conn.close()
+
+        return self._connect()
+
+    def release(self, conn, discard=False):
+        if conn is None:
+            return
+
+        if discard or not conn.connected:
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+
+        conn.close()
+
+    def warm(self):
+        """Open connections until the pool is full."""
+        while True:
+            with self._lock:
+                if len(self._idle) >= self.size:
+                    return
+
+            try:
+                conn = self._connect()
+            except CONNECTION_ERRORS as e:
+                print('Unable to warm TradingView connection pool!')
+                print(e)
+                return
+
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it if needed.
+
+    Sockets are never shared across a fork; a child process gets its own pool.
+    """
+    global _pool, _pool_pid
+
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool()
+                _pool_pid = os.getpid()
+
+    return _pool
@@ -0,0 +1,59 @@
+from tradingview.lazy import lazy
+
+np = lazy('numpy')
+Image = lazy('PIL.Image')
+ImageDraw = lazy('PIL.ImageDraw')
+
+
+SPARKLINE_SIZE = (250, 250)
+
+COLORS = {
+    # Same colors matplotlib used for 'g-' / 'r-'.
+    'green': (0, 128, 0),
+    'red': (255, 0, 0),
+}
+
+FILL_ALPHA = 26
+DOT_COLOR = (255, 0, 0)
+
+
+def render_sparkline(points, color, save_to, size=SPARKLINE_SIZE, padding=8, line_width=2, supersample=2):
+    """Draw a line + fill spark chart of `points` straight to a PNG.
+
+    Everything is drawn at `supersample` times the final size and scaled down
+    once, which is cheaper than matplotlib and gives us antialiasing for free.
+    """
+    y = np.asarray(points, dtype=np.float64)
+    if y.size == 0:
+        raise ValueError('Cannot render a chart without points')
+
+    rgb = COLORS.get(color, color)
+    width, height = size[0] * supersample, size[1] * supersample
+    pad = padding * supersample
+
+    low = y.min()
+    spread = (y.max() - low) or 1.0
+    step = (width - 2 * pad) / max(y.size - 1, 1)
+    scale = (height - 2 * pad) / spread
+    baseline = height - pad
+
+    # Flat x0, y0, x1, y1, ... float32 buffers go straight into Pillow.
+    line = np.empty(2 * y.size, dtype=np.float32)
+    line[0::2] = pad + np.arange(y.size) * step
+    line[1::2] = baseline - (y - low) * scale
+    outline = np.concatenate(([line[0], baseline], line, [line[-2], baseline])).astype(np.float32)
+
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+
+    fill = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(fill).polygon(outline, fill=(*rgb, FILL_ALPHA))
+    image.paste(fill, (0, 0), fill)
+
+    draw = ImageDraw.Draw(image)
+    draw.line(line, fill=rgb, width=line_width * supersample)
+
+    x, y = float(line[-2]), float(line[-1])
+    r = 2 * supersample
+    draw.ellipse((x - r, y - r, x + r, y + r), fill=DOT_COLOR)
+
+    image.resize(size, Image.LANCZOS).save(save_to, 'PNG', optimize=False)
@@ -0,0 +1,216 @@
+import os, random, string, threading
+from time import monotonic
+
+from tradingview.pool import CONNECTION_ERRORS, Connection
+from websocket import WebSocketTimeoutException
+
+
+class QuoteStream(threading.Thread):
+    """Keeps hot symbols subscribed on one socket and mirrors their quotes.
+
+    Hot symbols are the ones looked up in the last `hot_ttl` seconds plus
+    whatever `held` (a callable returning a set of symbols, typically every
+    symbol in someone's portfolio) says. TradingView pushes a `qsd` frame
+    whenever a field changes, and those are merged into an in-memory table
+    that lookups can read without touching the network.
+    """
+
+    def __init__(self, held=None, hot_ttl=900, refresh=60, max_symbols=200, silence=60):
+        super().__init__(name='quote-stream', daemon=True)
+        self.held_symbols = held or set
+        self.hot_ttl = hot_ttl
+        self.refresh = refresh
+        self.max_symbols = max_symbols
+        self.silence = silence
+
+        self.conn = None
+        self.session = None
+        self.table = {}
+        self.complete = set()
+        self.subscribed = set()
+        self.recent = {}
+        self.held = set()
+        self.last_refresh = 0
+        self.last_frame = 0
+
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def healthy(self):
+        return self.conn is not None and monotonic() - self.last_frame < self.silence
+
+    def touch(self, symbols):
+        now = monotonic()
+        with self._lock:
+            for symbol in symbols:
+                self.recent[symbol] = now
+                if symbol not in self.subscribed:
+                    self._dirty.set()
+
+    def get(self, symbol):
+        return self.get_many([symbol]).get(symbol)
+
+    def get_many(self, symbols):
+        """Returns copies of the quotes we have complete data for."""
+        if not self.healthy:
+            return {}
+
+        with self._lock:
+            return {symbol: dict(self.table[symbol]) for symbol in symbols if symbol in self.complete}
+
+    def stop(self):
+        self._stopped.set()
+
+    def wanted(self):
+        now = monotonic()
+        with self._lock:
+            for symbol, touched in list(self.recent.items()):
+                if now - touched > self.hot_ttl:
+                    del self.recent[symbol]
+
+            recent = sorted(self.recent, key=self.recent.get, reverse=True)
+
+        wanted = set(list(self.held)[:self.max_symbols])
+        for symbol in recent:
+            if len(wanted) >= self.max_symbols:
+                break
+            wanted.add(symbol)
+
+        return wanted
+
+    def run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                self._connect()
+                backoff = 1
+                while not self._stopped.is_set():
+                    self._sync()
+                    self._receive()
+            except CONNECTION_ERRORS as e:
+                print('Quote stream disconnected!')
+                print(e)
+            except Exception as e:
+                print('Quote stream failed!')
+                print(e)
+
+            self._disconnect()
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+        self._disconnect()
+
+    def _connect(self):
+        self.conn = Connection(timeout=1)
+        self.session = 'qs_' + ''.join(random.choice(string.ascii_lowercase) for i in range(12))
+        self.conn.send('quote_create_session', [self.session])
+        self.last_frame = monotonic()
+        self.last_refresh = 0
+
+    def _disconnect(self):
+        if self.conn is not None:
+            self.conn.close()
+
+        self.conn = None
+        with self._lock:
+            self.table.clear()
+            self.complete.clear()
+            self.subscribed.clear()
+
+    def _sync(self):
+        if monotonic() - self.last_refresh > self.refresh:
+            try:
+                self.held = self.held_symbols()
+            except Exception as e:
+                print('Unable to load held symbols!')
+                print(e)
+            self.last_refresh = monotonic()
+            self._dirty.set()
+
+        if not self._dirty.is_set():
+            return
+        self._dirty.clear()
+
+        wanted = self.wanted()
+        with self._lock:
+            add = wanted - self.subscribed
+            remove = self.subscribed - wanted
+
+        if remove:
+            self.conn.send('quote_remove_symbols', [self.session, *remove])
+            with self._lock:
+                for symbol in remove:
+                    self.subscribed.discard(symbol)
+                    self.complete.discard(symbol)
+                    self.table.pop(symbol, None)
+
+        if add:
+            self.conn.send('quote_add_symbols', [self.session, *add, {'flags': ['force_permission']}])
+            with self._lock:
+                self.subscribed.update(add)
+
+    def _receive(self):
+        try:
+            messages = self.conn.messages()
+        except WebSocketTimeoutException:
+            if monotonic() - self.last_frame > self.silence:
+                raise ConnectionError('No frames from TradingView, reconnecting')
+            return
+
+        self.last_frame = monotonic()
+
+        for resp in messages:
+            if 'm' not in resp or resp['p'][0] != self.session:
+                continue
+
+            self._apply(resp)
+
+    def _apply(self, resp):
+        with self._lock:
+            if resp['m'] == 'quote_completed':
+                if resp['p'][1] in self.subscribed:
+                    self.complete.add(resp['p'][1])
+                return
+
+            if resp['m'] != 'qsd':
+                return
+
+            symbol = resp['p'][1]['n']
+            if symbol not in self.subscribed:
+                return
+
+            if resp['p'][1]['s'] == 'error':
+                # Not a real symbol, stop asking for it.
+                self.complete.discard(symbol)
+                self.table.pop(symbol, None)
+                self.recent.pop(symbol, None)
+                self._dirty.set()
+                return
+
+            self.table.setdefault(symbol, {}).update(resp['p'][1]['v'])
+
+
+_stream = None
+_stream_pid = None
+
+
+def get_stream():
+    # A forked worker doesn't get the stream thread, only a stale copy of it.
+    if _stream_pid != os.getpid():
+        return None
+
+    return _stream
+
+
+def start_stream(held=None, **kwargs):
+    """Start the process-wide quote stream (once)."""
+    global _stream, _stream_pid
+
+    if get_stream() is None or not _stream.is_alive():
+        _stream = QuoteStream(held, **kwargs)
+        _stream_pid = os.getpid()
+        _stream.start()
+
+    return _stream
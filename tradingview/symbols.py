@@ -0,0 +1,227 @@
+"""Every listed symbol we can quote, with its exchange, type and description.
+
+The directory comes from TradingView's screener, the same scanner the
+technicals are fetched from, so its exchange names are the ones the
+technicals need. It is kept in a file, loaded into memory, and refreshed in
+the background, so checking or resolving a symbol never waits on the network.
+"""
+import bisect, json, os, threading
+from collections import namedtuple
+from time import monotonic, time
+from urllib.request import Request, urlopen
+
+from tradingview.metrics import span
+
+
+SCAN_URL = 'https://scanner.tradingview.com/{screener}/scan'
+PAGE = 10000
+
+# Stocks and funds, crypto pairs, currency pairs, and indices (with the other
+# CFDs), so that nothing the bot can quote is turned away.
+SCREENERS = ('america', 'crypto', 'forex', 'cfd')
+
+# When a symbol is listed more than once, the first of these wins.
+EXCHANGES = ['NASDAQ', 'NYSE', 'AMEX', 'CBOE', 'OTC']
+
+Listing = namedtuple('Listing', ['symbol', 'exchange', 'type', 'description'])
+
+
+def _rank(listing):
+    return EXCHANGES.index(listing.exchange) if listing.exchange in EXCHANGES else len(EXCHANGES)
+
+
+def fetch(screener, timeout=30):
+    """Every symbol in a TradingView screener ('america', 'crypto', ...)."""
+    listings = []
+    start = 0
+    while True:
+        payload = {
+            'filter': [],
+            'symbols': {'query': {'types': []}, 'tickers': []},
+            'columns': ['name', 'exchange', 'type', 'description'],
+            'sort': {'sortBy': 'name', 'sortOrder': 'asc'},
+            'range': [start, start + PAGE],
+        }
+        request = Request(
+            SCAN_URL.format(screener=screener),
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        with urlopen(request, timeout=timeout) as response:
+            result = json.load(response)
+
+        rows = result.get('data') or []
+        for row in rows:
+            name, exchange, kind, description = row['d'][:4]
+            # Missing fields, tabs and newlines would break the file format.
+            listings.append(Listing(name, exchange or '', kind or '', ' '.join((description or '').split())))
+
+        start += PAGE
+        if not rows or start >= result.get('totalCount', 0):
+            return listings
+
+
+class SymbolDirectory:
+    """In-memory symbol -> Listing index, backed by a file.
+
+    Until a directory has been loaded, every symbol counts as known, so a
+    missing or broken download never stops the bot from quoting. Processes
+    that share the file pick up a refresh made by any of them within
+    `check_every` seconds.
+    """
+
+    def __init__(self, path='symbols.tsv', screeners=SCREENERS, max_age=24 * 3600, check_every=60):
+        self.path = path
+        self.screeners = screeners
+        self.max_age = max_age
+        self.check_every = check_every
+
+        self._listings = {}
+        self._sorted = []
+        self._mtime = None
+        self._checked = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+        self.refreshes = 0
+        self.errors = 0
+        self.rejected = 0
+
+    @property
+    def ready(self):
+        return bool(self._listings)
+
+    def _index(self, listings):
+        index = {}
+        for listing in sorted(listings, key=_rank):
+            index.setdefault(listing.symbol, listing)
+        return index
+
+    def load(self):
+        """Read the directory file, if there is one. Returns whether it was
+        loaded."""
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding='utf-8') as f:
+                listings = [Listing(*line.rstrip('\n').split('\t', 3)) for line in f if line.strip()]
+        except (OSError, TypeError) as e:
+            print('Unable to load the symbol directory!')
+            print(e)
+            return False
+
+        index = self._index(listings)
+        with self._lock:
+            self._listings = index
+            self._sorted = sorted(index)
+            self._mtime = mtime
+            self._checked = monotonic()
+
+        return True
+
+    def _save(self, index):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for listing in index.values():
+                f.write('\t'.join(listing) + '\n')
+        os.replace(tmp, self.path)
+
+    def refresh(self):
+        """Download the directory, save it and swap it in."""
+        if not self._refreshing.acquire(blocking=False):
+            return False
+
+        try:
+            with span('symbols'):
+                listings = [listing for screener in self.screeners for listing in fetch(screener)]
+            if not listings:
+                raise ValueError('The screener returned no symbols')
+
+            index = self._index(listings)
+            self._save(index)
+            with self._lock:
+                self._listings = index
+                self._sorted = sorted(index)
+                self._mtime = os.path.getmtime(self.path)
+                self._checked = monotonic()
+            self.refreshes += 1
+            return True
+        except Exception as e:
+            self.errors += 1
+            print('Unable to refresh the symbol directory!')
+            print(e)
+            return False
+        finally:
+            self._refreshing.release()
+
+    def stale(self):
+        return self._mtime is None or time() - self._mtime > self.max_age
+
+    def start(self):
+        """Load what's on disk now, and refresh in the background if that's
+        missing or old."""
+        self.load()
+        if self.stale():
+            threading.Thread(target=self.refresh, name='symbols', daemon=True).start()
+
+    def maybe_reload(self):
+        with self._lock:
+            due = self._checked is not None and monotonic() - self._checked > self.check_every
+            if due:
+                self._checked = monotonic()
+
+        if not due:
+            return
+
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return
+
+        if changed:
+            self.load()
+
+    def get(self, symbol):
+        self.maybe_reload()
+        return self._listings.get(symbol)
+
+    def known(self, symbol):
+        """False only for symbols a loaded directory doesn't have."""
+        if not self.ready or self.get(symbol) is not None:
+            return True
+
+        self.rejected += 1
+        return False
+
+    def exchange(self, symbol):
+        listing = self.get(symbol)
+        return listing.exchange if listing is not None else None
+
+    def prefix(self, prefix, limit=10):
+        """Listings whose symbol starts with `prefix`, alphabetically."""
+        self.maybe_reload()
+        with self._lock:
+            symbols, listings = self._sorted, self._listings
+
+        start = bisect.bisect_left(symbols, prefix)
+        matches = []
+        for symbol in symbols[start:start + limit]:
+            if not symbol.startswith(prefix):
+                break
+            matches.append(listings[symbol])
+
+        return matches
+
+    def stats(self):
+        return {
+            'size': len(self._listings),
+            'age': time() - self._mtime if self._mtime is not None else None,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+            'rejected': self.rejected,
+        }
+
+
+directory = SymbolDirectory()
@@ -0,0 +1,120 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from tradingview import market
+from tradingview.lazy import lazy
+from tradingview.metrics import span
+from tradingview.symbols import directory
+
+ta = lazy('tradingview_ta')
+
+# tradingview_ta's Interval values, spelled out so it needn't be imported yet.
+INTERVAL_1_DAY = '1d'
+
+
+# How long a summary stays good, roughly a fraction of the candle it's built on.
+# While the market is shut they hold until it reopens.
+TTLS = {
+    '1m': 30,
+    '5m': 60,
+    '15m': 180,
+    '1h': 300,
+    '4h': 900,
+    INTERVAL_1_DAY: 900,
+    '1W': 3600,
+    '1M': 3600,
+}
+
+
+class Technicals:
+    """Cached, batched TradingView technical analysis summaries.
+
+    Summaries are cached per (symbol, exchange, interval). Misses are fetched
+    with a single multi-symbol scanner request, and `submit` runs that on a
+    background thread so it can overlap with the websocket quote fetch.
+    """
+
+    def __init__(self, screener='america', workers=2, timeout=10):
+        self.screener = screener
+        self.timeout = timeout
+
+        self.exchanges = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='technicals')
+
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.errors = 0
+
+    def remember(self, symbol, exchange):
+        if exchange:
+            self.exchanges[symbol] = exchange
+
+    def exchange(self, symbol):
+        return self.exchanges.get(symbol) or directory.exchange(symbol)
+
+    def get_many(self, symbols, interval=INTERVAL_1_DAY, refresh=False):
+        """`symbols` maps symbol -> exchange. Returns symbol -> summary for the
+        ones TradingView had an analysis for. `refresh` skips the cache, for
+        refetching summaries before they go stale."""
+        now = monotonic()
+        results = {}
+        missing = {}
+
+        with self._lock:
+            for symbol, exchange in symbols.items():
+                entry = None if refresh else self._cache.get((symbol, exchange, interval))
+                if entry is not None and entry[0] > now:
+                    results[symbol] = entry[1]
+                    self.hits += 1
+                else:
+                    missing[f'{exchange}:{symbol}'.upper()] = symbol
+                    self.misses += 1
+
+        if not missing:
+            return results
+
+        try:
+            self.requests += 1
+            with span('technicals'):
+                analysis = ta.get_multiple_analysis(self.screener, interval, list(missing), timeout=self.timeout)
+        except Exception as e:
+            self.errors += 1
+            print('Unable to get technicals!')
+            print(e)
+            return results
+
+        expires = monotonic() + market.ttl(TTLS.get(interval, 900))
+        with self._lock:
+            for ticker, symbol in missing.items():
+                if analysis.get(ticker) is None:
+                    continue
+
+                summary = analysis[ticker].summary
+                self._cache[(symbol, symbols[symbol], interval)] = (expires, summary)
+                results[symbol] = summary
+
+            for key in [key for key, entry in self._cache.items() if entry[0] <= now]:
+                del self._cache[key]
+
+        return results
+
+    def submit(self, symbols, interval=INTERVAL_1_DAY):
+        return self._executor.submit(self.get_many, symbols, interval)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'requests': self.requests,
+            'errors': self.errors,
+        }
+
+
+technicals = Technicals()
@@ -0,0 +1,132 @@
+import multiprocessing, queue, threading, traceback
+from time import monotonic
+
+
+# Workers inherit the parent's state (Stocky, Redis client, ...) by forking.
+_mp = multiprocessing.get_context('fork')
+
+
+class _Counter:
+    """Counter that works the same in thread and process mode."""
+
+    def __init__(self, shared=False):
+        self._value = _mp.Value('q', 0) if shared else None
+        self._local = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        if self._value is not None:
+            with self._value.get_lock():
+                self._value.value += n
+        else:
+            with self._lock:
+                self._local += n
+
+    @property
+    def value(self):
+        return self._value.value if self._value is not None else self._local
+
+
+class JobQueue:
+    """Bounded queue of jobs handled by a pool of worker threads or processes.
+
+    `submit` never blocks for longer than `put_timeout`; if the queue is still
+    full after that the job is rejected so the caller can shed load. In
+    process mode `handler` has to be importable (a module level function) and
+    each worker process works with its own copy of the parent's state, and
+    calls `initializer` (if given) as it starts.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=100, mode='thread', put_timeout=0.5, initializer=None):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f'Unknown worker mode {mode}')
+
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.mode = mode
+        self.put_timeout = put_timeout
+        self.initializer = initializer
+
+        shared = mode == 'process'
+        self._queue = _mp.Queue(maxsize) if shared else queue.Queue(maxsize)
+        self._pool = []
+
+        self.submitted = _Counter()
+        self.rejected = _Counter()
+        self.completed = _Counter(shared)
+        self.failed = _Counter(shared)
+        self.waited_ms = _Counter(shared)
+        self.max_depth = 0
+
+    def start(self):
+        for i in range(self.workers):
+            if self.mode == 'process':
+                worker = _mp.Process(target=self._work, name=f'worker-{i}', daemon=True)
+            else:
+                worker = threading.Thread(target=self._work, name=f'worker-{i}', daemon=True)
+
+            worker.start()
+            self._pool.append(worker)
+
+        return self
+
+    def submit(self, job):
+        try:
+            self._queue.put((monotonic(), job), timeout=self.put_timeout)
+        except queue.Full:
+            self.rejected.add()
+            return False
+
+        self.submitted.add()
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    @property
+    def depth(self):
+        try:
+            return self._queue.qsize()
+        except NotImplementedError:
+            return -1
+
+    def stop(self, timeout=5):
+        for worker in self._pool:
+            self._queue.put((None, None))
+
+        for worker in self._pool:
+            worker.join(timeout)
+
+        self._pool = []
+
+    def _work(self):
+        if self.mode == 'process' and self.initializer is not None:
+            self.initializer()
+
+        while True:
+            queued, job = self._queue.get()
+            if queued is None:
+                return
+
+            self.waited_ms.add(int((monotonic() - queued) * 1000))
+            try:
+                self.handler(job)
+                self.completed.add()
+            except:
+                self.failed.add()
+                traceback.print_exc()
+
+    def stats(self):
+        handled = self.completed.value + self.failed.value
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'alive': sum(1 for worker in self._pool if worker.is_alive()),
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'maxsize': self.maxsize,
+            'submitted': self.submitted.value,
+            'rejected': self.rejected.value,
+            'completed': self.completed.value,
+            'failed': self.failed.value,
+            'avg_wait_ms': self.waited_ms.value / handled if handled else 0.0,
+        }